@@ -1,3 +1,8 @@
+from data_model import Record, ProgressionRow
+from collections.abc import Mapping
+
+
+
 def arrange_class_features(features):
 	'''
 	This will take in the features dataset.
@@ -29,36 +34,23 @@ def arrange_class_features(features):
 
 
 
-def compose_class_progressions(class_features):
+def compose_class_progressions(class_features, level_cap = 20):
 	'''
 	This takes in compiled class_features.
 	By looping through each class and feature, this function
 	is able to create a table for players to use as an index.
 	By default, the progression table will be sorted by level.
 	Each class has a progression table, and each get returned.
+	---
+	Tables are built column by column, indexed by level,
+	and only turned into rows (one per level) at the end.
+	The level_cap sets how many levels each table has.
 	'''
-	# Create a sorted_class_features dictionary object.
-	# Also create a class_progression dictionary object.
-	sorted_class_features = {}
+	# Create a class_progression dictionary object.
 	class_progressions = {} # *this will be returned later*
 
-
 	# Loop through each and every class_name.
 	for class_name in class_features:
-		# Initialize empty array to hold class progression rows.
-		# Each row will have a distinct level.
-		# ---
-		# An object or dictionary could have been used, but...
-		# This data will be ported over to JSON.
-		# JSON doesn't support integer keys. I don't like that.
-		class_progression = []
-		class_progressions[class_name] = class_progression
-		for level in range(1, 21):
-			class_progression.append({
-				'Level': level,
-				'Features': [],
-			})
-
 		# Create an array of class features, sorted by names.
 		# These only contain certain features; specifically, the
 		# 	ones for this class that appear in the progression.
@@ -66,71 +58,118 @@ def compose_class_progressions(class_features):
 		sorted_features = list(sorted_features)
 		sorted_features.sort(key = lambda x: x['slug'])
 
-		# Loop through each sorted feature's data, in order.
+		# Build the table as columns, then turn it into rows.
+		table = ProgressionTable(level_cap)
 		for feature in sorted_features:
-
 			# Here, progression is short for feature progression.
 			# 	(rather than the whole class progression)
 			progression = \
 				feature['classes'][class_name]['progression']
-
-			# Each row in the progression dictionary should
-			# 	already be sorted numerically by levels.
-			# Even so, it may be safer to just re-sort it here.
-			progression.sort(key = lambda x: x['Level'])
-
-			# Loop through each row of this feature's progression.
-			# Each feature has a progression that should be added
-			# 	to the entire class progression table.
-			for row in progression:
-				level = row['Level']
-				for column, value in row.items():
-
-					# "Level" already exists in all rows.
-					if column == 'Level':
-						pass
-
-					elif column == 'Feature':
-						# Filter the entry whose level is equal.
-						filterer = lambda row: row['Level'] == level
-						[entry] = [*filter(filterer, class_progression)]
-						# Once we have this entry, we can add to it.
-						# Notice Features is plural, denoting an array.
-						entry['Features'].append(value)
-
-					else:
-						# The column is custom (not a Level or Feature).
-						# We have to loop through every level of entry.
-						# If it hasn't been added, add it with None.
-						# If the level is valid, replace it with value.
-						for entry in class_progression:
-							if column not in entry:
-								entry[column] = None
-							if entry['Level'] >= row['Level']:
-								entry[column] = value
-
-			# What's more -- the columns could be in a group!
-			group_entries = {}
-			for row in progression:
-				for column, group in row.items():
-					if isinstance(group, dict):
-						if column not in group_entries:
-							group_entries[column] = []
-						for item in group:
-							if item not in group_entries[column]:
-								group_entries[column].append(item)
-			# Now we have all the group keys.
-			for row in progression:
-				for column, group in row.items():
-					if isinstance(group, dict):
-						for subcolumn in group_entries[column]:
-							if subcolumn not in group:
-								group[subcolumn] = None
-			# Phew... All the keys will have been filled.
-
-		# Revert and sort class progresions
-		class_progression.sort(key = lambda row: row['Level'])
-		class_progressions[class_name] = class_progression
+			table.add_progression(progression)
+		class_progressions[class_name] = table.rows()
 
 	# All class progressions have been completely filled.
 	return class_progressions
+
+
+
+class ProgressionTable:
+	'''
+	A class progression table, stored column by column.
+	Every column is a list indexed directly by level;
+	index zero is unused, so level 1 sits at index 1.
+	---
+	A custom column's value applies from its level onward,
+	until a later write replaces it. Rather than rewriting
+	every level on each write, writes are marked at their
+	level with a sequence number; the marks are forward-filled
+	once, when the rows are made. The latest write wins.
+	'''
+	def __init__(self, level_cap = 20):
+		self.level_cap = level_cap
+		self.features = [[] for _ in range(level_cap + 1)]
+		# Custom columns, in order of first appearance.
+		self.marks = {}
+		self.writes = 0
+
+	def add_progression(self, progression):
+		# Each row in the progression dictionary should
+		# 	already be sorted numerically by levels.
+		# Even so, it may be safer to just re-sort it here.
+		# The feature's own progression is left alone.
+		progression = sorted(progression, key = lambda x: x['Level'])
+
+		# What's more -- the columns could be in a group!
+		# Every row's group gets every sub-column of its column.
+		group_entries = {}
+		for row in progression:
+			for column, group in row.items():
+				if isinstance(group, Mapping):
+					if column not in group_entries:
+						group_entries[column] = {}
+					for item in group:
+						group_entries[column][item] = None
+
+		# Loop through each row of this feature's progression.
+		# Each feature has a progression that should be added
+		# 	to the entire class progression table.
+		for row in progression:
+			level = row['Level']
+			for column, value in row.items():
+
+				# "Level" already exists in all rows.
+				if column == 'Level':
+					pass
+
+				elif column == 'Feature':
+					# Notice Features is plural, denoting an array.
+					if not 1 <= level <= self.level_cap:
+						raise ValueError(f'{value}: level {level} is out of range')
+					self.features[level].append(value)
+
+				else:
+					# The column is custom (not a Level or Feature).
+					if column not in self.marks:
+						self.marks[column] = [None] * (self.level_cap + 1)
+					if isinstance(value, Mapping):
+						# Pad out a copy; the feature data is left alone.
+						value = {**value}
+						for item in group_entries[column]:
+							if item not in value:
+								value[item] = None
+						value = Record(value.keys(), value.values())
+					# Writes past the cap never show up in the table.
+					if level <= self.level_cap:
+						self.writes += 1
+						self.marks[column][max(level, 1)] = (self.writes, value)
+
+	def column(self, column):
+		# Forward-fill this column's marks.
+		values = [None] * (self.level_cap + 1)
+		latest = (0, None)
+		marks = self.marks[column]
+		for level in range(1, self.level_cap + 1):
+			mark = marks[level]
+			if mark is not None and mark[0] > latest[0]:
+				latest = mark
+			values[level] = latest[1]
+		return values
+
+	def rows(self):
+		# Initialize array to hold class progression rows.
+		# Each row will have a distinct level.
+		# ---
+		# An object or dictionary could have been used, but...
+		# This data will be ported over to JSON.
+		# JSON doesn't support integer keys. I don't like that.
+		columns = {column: self.column(column) for column in self.marks}
+		class_progression = []
+		for level in range(1, self.level_cap + 1):
+			row = {
+				'Level': level,
+				'Features': tuple(self.features[level]),
+			}
+			for column, values in columns.items():
+				row[column] = values[level]
+			class_progression.append(ProgressionRow(row.keys(), row.values()))
+		return tuple(class_progression)
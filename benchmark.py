@@ -0,0 +1,255 @@
+from obtain_data import collect_data
+from arrange_data import arrange_class_features
+from arrange_data import compose_class_progressions
+from write_feature_descriptions import generate_descriptions
+from write_feature_descriptions import compile_template
+from write_class_summaries import generate_summaries, table_cache
+from time import perf_counter
+import tempfile
+import argparse
+import platform
+import random
+import json
+import os
+
+# The shape of the default synthetic corpus.
+default_shape = {
+	'classes': 12,
+	'features': 400,
+	'template_lines': 12,
+	'tags': 6,
+	'rows': 3,
+	'grouped_columns': 1,
+	'child_depth': 1,
+}
+
+
+
+def generate_corpus(
+	directory,
+	classes = 12,
+	features = 400,
+	template_lines = 12,
+	tags = 6,
+	rows = 3,
+	grouped_columns = 1,
+	child_depth = 1,
+	seed = 0,
+):
+	'''
+	This writes a synthetic data repository into directory,
+	laid out like the real one, so it can be read with
+	collect_data(local_dir = directory).
+	---
+	Every class gets a share of the features, each with up to
+	the given number of progression rows; one in ten features
+	also adds the given number of grouped columns. A further
+	child_depth generations of child features hang off the
+	features, each generation a quarter the size of the last.
+	Templates have template_lines lines, with tags spread
+	throughout (class and level tags, and variables); a level
+	tag past the end of a progression deletes its line.
+	'''
+	generator = random.Random(seed)
+	version_dir = os.path.join(directory, 'source', 'homebrew')
+	features_dir = os.path.join(version_dir, 'abilities', 'features')
+	classes_dir = os.path.join(version_dir, 'vocations', 'classes')
+	os.makedirs(features_dir, exist_ok=True)
+	os.makedirs(classes_dir, exist_ok=True)
+
+	class_names = [f'class-{index:03}' for index in range(classes)]
+	for class_name in class_names:
+		write_entry(classes_dir, class_name, {
+			'hit-dice': f'1d{generator.choice([6, 8, 10, 12])}',
+			'structured-data': {
+				'Prerequisites': {'Abilities': [
+					{'choose': 1, 'selection': ['Strength 13', 'Dexterity 13']},
+				]},
+				'Proficiencies': {
+					'Armor': [{'choose': None, 'selection': ['light armor', ['shields']]}],
+					'Skills': [{'choose': 2, 'selection': ['Arcana', 'History', 'Insight']}],
+				},
+				'Equipment': {'Weapons': [
+					{'choose': 1, 'selection': ['a dagger', ['a sword', 'a shield']]},
+				]},
+				'Multiclassing': {'Armor': [
+					{'choose': None, 'selection': ['light armor']},
+				]},
+			},
+		}, f'# {class_name}\nIntroduction.\n\n`{{( class-features )}}`\n\nClosing words.\n')
+
+	# Generations of features; the first has the progressions.
+	generations = [[f'feature-{index:05}' for index in range(features)]]
+	size = features
+	for depth in range(child_depth):
+		size = max(1, size // 4)
+		generations.append([f'child-{depth}-{index:05}' for index in range(size)])
+
+	for depth, generation in enumerate(generations):
+		children = generations[depth + 1] if depth + 1 < len(generations) else []
+		for index, feature_name in enumerate(generation):
+			# Children are described for whichever class their
+			# 	parent is, so they carry data for every class.
+			feature_classes = {}
+			if depth == 0:
+				owners = generator.sample(class_names, min(len(class_names), 2))
+			else:
+				owners = class_names
+			for class_name in owners:
+				feature_class = {'variables': {'dice': f'{index % 4 + 1}d6'}}
+				if depth == 0:
+					feature_class['progression'] = make_progression(
+						generator, feature_name, rows,
+						grouped_columns if index % 10 == 0 else 0,
+					)
+				if children and generator.random() < 0.25:
+					feature_class['children'] = generator.sample(children, min(2, len(children)))
+				feature_classes[class_name] = feature_class
+			write_entry(
+				features_dir,
+				feature_name,
+				{'slug': feature_name, 'classes': feature_classes},
+				make_template(generator, feature_name, template_lines, tags, depth == 0),
+			)
+
+
+
+def make_progression(generator, feature_name, rows, grouped_columns):
+	levels = sorted(generator.sample(range(1, 21), min(20, rows)))
+	progression = []
+	for row_index, level in enumerate(levels):
+		row = {'Level': level}
+		if row_index == 0 or generator.random() < 0.5:
+			row['Feature'] = feature_name.replace('-', ' ').title()
+		for column in range(grouped_columns):
+			row[f'Group {column}'] = {
+				ordinal: row_index + slot
+				for slot, ordinal in enumerate(['1st', '2nd', '3rd'][:row_index + 1])
+			}
+		progression.append(row)
+	return progression
+
+
+
+def make_template(generator, feature_name, template_lines, tags, levels):
+	lines = [f'# {feature_name}']
+	words = 'the of and a to in is you that it for as with'.split()
+	for _ in range(template_lines):
+		lines.append(' '.join(generator.choice(words) for _ in range(12)))
+	# Only features with a progression get level tags.
+	names = ['class', 'dice']
+	if levels:
+		names += ['level', 'all-levels', 'levels']
+	for index in range(tags):
+		line = generator.randrange(1, len(lines))
+		lines[line] += f' `{{( {names[index % len(names)]} )}}`'
+	return '\n'.join(lines) + '\n'
+
+
+
+def write_entry(directory, slug, data, template):
+	with open(os.path.join(directory, slug + '.json'), 'w') as file:
+		json.dump(data, file)
+	with open(os.path.join(directory, slug + '.md'), 'w') as file:
+		file.write(template)
+
+
+
+def time_stages(directory, repeat = 3):
+	'''
+	This runs each pipeline stage over a generated corpus,
+	repeat times, and returns the best seconds per stage.
+	Loading skips the snapshot, so it is measured for real;
+	likewise, in-process caches are emptied before each repeat.
+	'''
+	best = {}
+	for _ in range(repeat):
+		compile_template.cache_clear()
+		table_cache.clear()
+		stages = {}
+		started = perf_counter()
+		all_classes, all_features = collect_data(local_dir = directory, snapshot = False)
+		stages['collect_data'] = perf_counter() - started
+
+		started = perf_counter()
+		descriptions = {}
+		generate_descriptions(all_features, descriptions)
+		stages['generate_descriptions'] = perf_counter() - started
+
+		started = perf_counter()
+		class_features = arrange_class_features(all_features)
+		stages['arrange_class_features'] = perf_counter() - started
+
+		started = perf_counter()
+		class_progressions = compose_class_progressions(class_features)
+		stages['compose_class_progressions'] = perf_counter() - started
+
+		started = perf_counter()
+		generate_summaries(class_features, class_progressions, all_classes, descriptions)
+		stages['generate_summaries'] = perf_counter() - started
+
+		for stage, seconds in stages.items():
+			best[stage] = min(seconds, best.get(stage, seconds))
+	best['total'] = sum(best.values())
+	return best
+
+
+
+def run_benchmarks(shapes, repeat = 3, label = None):
+	'''
+	This times every stage for each corpus shape, and returns
+	the results in a form ready to be saved as JSON.
+	A label (a commit hash, say) is stored alongside them.
+	'''
+	runs = []
+	for shape in shapes:
+		with tempfile.TemporaryDirectory() as directory:
+			generate_corpus(directory, **shape)
+			runs.append({'shape': shape, 'seconds': time_stages(directory, repeat)})
+	return {
+		'label': label,
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'repeat': repeat,
+		'runs': runs,
+	}
+
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description = 'Time each pipeline stage over synthetic corpora.',
+	)
+	for name, value in default_shape.items():
+		parser.add_argument(
+			'--' + name.replace('_', '-'),
+			type = int,
+			default = value,
+			help = f'corpus shape (default {value})',
+		)
+	parser.add_argument(
+		'--scale',
+		metavar = 'NAME=N,N,...',
+		help = 'run once per value of one shape parameter, eg. features=100,1000',
+	)
+	parser.add_argument('--repeat', type = int, default = 3)
+	parser.add_argument('--label', help = 'stored with the results, eg. a commit')
+	parser.add_argument('--output', metavar = 'FILE', help = 'write JSON here')
+	arguments = parser.parse_args()
+
+	shape = {name: getattr(arguments, name) for name in default_shape}
+	shapes = [shape]
+	if arguments.scale:
+		name, _, values = arguments.scale.partition('=')
+		name = name.replace('-', '_')
+		if name not in default_shape:
+			parser.error(f'unknown shape parameter: {name}')
+		shapes = [{**shape, name: int(value)} for value in values.split(',')]
+
+	results = run_benchmarks(shapes, arguments.repeat, arguments.label)
+	output = json.dumps(results, indent='\t')
+	if arguments.output:
+		with open(arguments.output, 'w') as file:
+			file.write(output + '\n')
+	else:
+		print(output)
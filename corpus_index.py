@@ -0,0 +1,121 @@
+from obtain_data import features_directory, classes_directory
+from obtain_data import collect_entries, parse_json
+from data_model import load_feature, load_class
+from snapshot import snapshot_key, source_slot, replace_latest
+import json
+import os
+import re
+
+# Bump this whenever the shape of the index changes.
+INDEX_FORMAT = 3
+
+
+
+def build_index(source, version):
+	'''
+	This builds a lightweight index of the corpus, reading
+	only the JSON of each feature (never its template):
+	---
+	classes: each class (with files) -> its progression's features,
+	children: each feature -> class -> its child features,
+	reachable: every feature any class needs (sorted).
+	'''
+	# Only classes with files of their own are indexed, even
+	# 	if features name others; those are never built.
+	filenames = set(source.filenames(classes_directory(version)))
+	members = {}
+	for filename in sorted(filenames):
+		class_name, _, _ = filename.rpartition('.')
+		if f'{class_name}.json' in filenames and f'{class_name}.md' in filenames:
+			members[class_name] = []
+
+	directory = features_directory(version)
+	slugs = sorted({
+		re.match(r'^(.*)(?=\.(.+))', filename).group()
+		for filename in source.filenames(directory)
+	})
+	children = {}
+	for feature_name in slugs:
+		path = directory + feature_name + '.json'
+		feature = parse_json(source.read(path), path)
+		for class_name, feature_class in feature.get('classes', {}).items():
+			if 'progression' in feature_class and class_name in members:
+				members[class_name].append(feature_name)
+			if feature_class.get('children'):
+				children.setdefault(feature_name, {})
+				children[feature_name][class_name] = [*feature_class['children']]
+
+	index = {'classes': members, 'children': children}
+	index['reachable'] = sorted(needed_features(index, members))
+	return index
+
+
+
+def load_index(source, version, index_dir = './downloads/indexes/'):
+	'''
+	This returns the index of a source, building and saving
+	it first if this exact tree has not been indexed before.
+	Only the latest index of each source is kept.
+	'''
+	key = snapshot_key(source.fingerprint(version), f'index-{INDEX_FORMAT}-{version}')
+	filepath = index_dir + key + '.json'
+	try:
+		with open(filepath) as file:
+			return json.load(file)
+	except (FileNotFoundError, ValueError):
+		pass
+
+	index = build_index(source, version)
+	os.makedirs(index_dir, exist_ok=True)
+	partial = filepath + f'.{os.getpid()}.partial'
+	with open(partial, 'w') as file:
+		json.dump(index, file)
+	os.replace(partial, filepath)
+	replace_latest(index_dir, source_slot(source, version), key + '.json')
+	return index
+
+
+
+def needed_features(index, class_names):
+	'''
+	These are the features a set of classes needs loaded:
+	those in their progressions, plus (for each such class)
+	the children spliced into those features' descriptions.
+	'''
+	needed = set()
+	for class_name in class_names:
+		for feature_name in index['classes'][class_name]:
+			needed.add(feature_name)
+			children = index['children'].get(feature_name, {})
+			needed.update(children.get(class_name, []))
+	return needed
+
+
+
+def load_classes(source, version, class_names, workers = 1, index = None):
+	'''
+	This loads only what the given classes need: their own
+	entries and the features they use (see needed_features).
+	It returns a (classes, features) pair like collect_data.
+	'''
+	if index is None:
+		index = load_index(source, version)
+	# A class only exists if both of its files do; features
+	# 	may name classes that have none.
+	filenames = set(source.filenames(classes_directory(version)))
+	unknown = [
+		name for name in class_names
+		if f'{name}.json' not in filenames or f'{name}.md' not in filenames
+	]
+	if unknown:
+		raise KeyError(f'no such class: {", ".join(unknown)}')
+
+	classes = collect_entries(
+		source, classes_directory(version), workers, only = class_names,
+		load = load_class,
+	)
+	features = collect_entries(
+		source, features_directory(version), workers,
+		only = needed_features(index, class_names), load = load_feature,
+	)
+	return classes, features
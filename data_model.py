@@ -0,0 +1,154 @@
+from collections.abc import Mapping
+
+
+
+class Record(Mapping):
+	'''
+	An immutable mapping, for data loaded from JSON.
+	It reads like the dictionary it came from (record[key],
+	in, get, items, ...), but nothing can be written to it;
+	so records are safe to cache, share and send to workers.
+	---
+	The values live in a tuple, and the keys in a layout
+	(key -> position) shared by every record with the same
+	keys, in the same order; eg. by every row of a table.
+	A record costs little more than its tuple of values.
+	'''
+	__slots__ = ('fields', 'cells')
+
+	def __init__(self, keys, values):
+		object.__setattr__(self, 'fields', layout(tuple(keys)))
+		object.__setattr__(self, 'cells', tuple(values))
+
+	def __setattr__(self, name, value):
+		raise AttributeError(f'{type(self).__name__} is immutable')
+
+	def __getitem__(self, key):
+		value = self.cells[self.fields[key]]
+		if isinstance(value, Deferred):
+			return value.resolve()
+		return value
+
+	def __contains__(self, key):
+		return key in self.fields
+
+	def __iter__(self):
+		return iter(self.fields)
+
+	def __len__(self):
+		return len(self.fields)
+
+	def __repr__(self):
+		return f'{type(self).__name__}({dict(self.items())!r})'
+
+	def __reduce__(self):
+		return (type(self), (tuple(self.fields), self.cells))
+
+
+
+class Feature(Record):
+	'''
+	A feature, as loaded from its JSON and markdown template.
+	The progression of each of its classes is a tuple of
+	ProgressionRow, sorted by level once, as it is loaded.
+	'''
+	__slots__ = ()
+
+class ClassData(Record):
+	'''
+	A class, as loaded from its JSON and markdown template.
+	'''
+	__slots__ = ()
+
+class ProgressionRow(Record):
+	'''
+	One row of a progression table (a feature's or a class's).
+	Grouped columns hold a Record of their sub-columns.
+	'''
+	__slots__ = ()
+
+
+
+class DataProblems(ValueError):
+	'''
+	Problems in the data (or in what was built from it), all
+	found at once; each is a line of the message, under the
+	heading. These are for the user to fix, not bugs.
+	'''
+	def __init__(self, problems, heading = 'problems found in the data'):
+		super().__init__(heading + ':\n' + '\n'.join(problems))
+		self.problems = list(problems)
+
+
+
+class Deferred:
+	'''
+	A value a Record loads only once it is first looked up
+	(eg. a template that may never be needed); see resolve.
+	'''
+	def resolve(self):
+		raise NotImplementedError
+
+
+
+# Every distinct tuple of keys gets one shared layout.
+layouts = {}
+def layout(keys):
+	fields = layouts.get(keys)
+	if fields is None:
+		fields = layouts.setdefault(keys, {key: index for index, key in enumerate(keys)})
+	return fields
+
+
+
+def freeze(value, record = Record):
+	'''
+	This turns parsed JSON into records (dictionaries,
+	as the given type) and tuples (lists), all the way down.
+	'''
+	if isinstance(value, dict):
+		return record(value.keys(), [freeze(item) for item in value.values()])
+	if isinstance(value, list):
+		return tuple(freeze(item) for item in value)
+	return value
+
+
+
+def thaw(value):
+	'''
+	This turns records and tuples back into plain JSON data.
+	'''
+	if isinstance(value, Mapping):
+		return {key: thaw(item) for key, item in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [thaw(item) for item in value]
+	return value
+
+
+
+def load_feature(entry):
+	'''
+	This freezes a parsed feature entry into a Feature,
+	with each class progression made of sorted ProgressionRow.
+	'''
+	if 'classes' in entry:
+		classes = {}
+		for class_name, feature_class in entry['classes'].items():
+			if 'progression' in feature_class:
+				progression = [
+					freeze(row, ProgressionRow)
+					for row in feature_class['progression']
+				]
+				progression.sort(key = lambda row: row['Level'])
+				feature_class = {**feature_class, 'progression': tuple(progression)}
+			classes[class_name] = freeze(feature_class)
+		entry = {**entry, 'classes': Record(classes.keys(), classes.values())}
+	return freeze(entry, Feature)
+
+
+
+def load_class(entry):
+	'''
+	This freezes a parsed class entry into a ClassData.
+	'''
+	return freeze(entry, ClassData)
@@ -0,0 +1,140 @@
+from email.utils import formatdate, parsedate_to_datetime
+from threading import Lock, get_ident
+import hashlib
+import time
+import json
+import os
+
+
+
+def archive_url(references):
+	'''
+	This builds the download URL of a repository archive.
+	The scheme defaults to https, but may be overridden
+	(eg. plain http against a local stand-in server).
+	'''
+	download_url = f'{references.get("scheme", "https")}://'
+	download_url += f'{references["website"]}/'
+	download_url += f'{references["account"]}/'
+	download_url += f'{references["project"]}/'
+	download_url += 'archive/'
+	download_url += f'{references["branch"]}.zip'
+	return download_url
+
+
+
+def fetch_archive(
+	references,
+	cache_dir = './downloads/cache/',
+	redownload = True,
+	offline = False,
+):
+	'''
+	This returns the filepath of a cached repository archive.
+	Archives are stored under the sha256 hash of their content,
+	and an index maps each archive URL to its latest hash,
+	along with the ETag and Last-Modified headers it came with.
+	---
+	If redownload is set, the server is asked whether the
+	archive changed (a conditional request), so an unchanged
+	upstream costs one round trip and zero bytes.
+	Otherwise, and always when offline, any cached archive
+	is used as-is. Offline, a missing archive is an error.
+	'''
+	download_url = archive_url(references)
+	index = read_index(cache_dir)
+	entry = index.get(download_url)
+
+	# Find the cached archive for this URL, if any.
+	filepath = None
+	if entry is not None:
+		filepath = cache_dir + entry['digest'] + '.zip'
+		if not os.path.isfile(filepath):
+			entry, filepath = None, None
+
+	if offline or (filepath is not None and not redownload):
+		if filepath is None:
+			raise FileNotFoundError(f'no cached archive for {download_url}')
+		return filepath
+
+	# Ask for the archive only if it has changed since.
+	headers = {}
+	if entry is not None:
+		if entry.get('etag'):
+			headers['If-None-Match'] = entry['etag']
+		if entry.get('last-modified'):
+			headers['If-Modified-Since'] = entry['last-modified']
+		else:
+			headers['If-Modified-Since'] = formatdate(entry['fetched'], usegmt=True)
+
+	# Importing requests is slow; only do so for a real fetch.
+	import requests
+	response = requests.get(download_url, headers=headers, stream=True)
+	with response:
+		if response.status_code == 304 and filepath is not None:
+			return filepath
+		response.raise_for_status()
+
+		# Stream the archive to disk, hashing as it goes.
+		os.makedirs(cache_dir, exist_ok=True)
+		digest = hashlib.sha256()
+		partial = cache_dir + f'partial-{os.getpid()}-{get_ident()}.zip'
+		with open(partial, 'wb') as file:
+			for chunk in response.iter_content(1 << 16):
+				digest.update(chunk)
+				file.write(chunk)
+		digest = digest.hexdigest()
+
+		# Identical content is only ever kept once.
+		filepath = cache_dir + digest + '.zip'
+		os.replace(partial, filepath)
+
+	# Other threads may have fetched meanwhile; merge with them.
+	with index_lock:
+		index = read_index(cache_dir)
+		index[download_url] = {
+			'digest': digest,
+			'etag': response.headers.get('ETag'),
+			'last-modified': response.headers.get('Last-Modified'),
+			'fetched': response_time(response),
+		}
+		write_index(cache_dir, index)
+
+		# Drop the superseded archive, unless something else uses it.
+		if entry is not None and entry['digest'] != digest:
+			digests = {other['digest'] for other in index.values()}
+			if entry['digest'] not in digests:
+				os.remove(cache_dir + entry['digest'] + '.zip')
+	return filepath
+
+
+
+def response_time(response):
+	'''
+	The server's Date header, as a timestamp (now if absent).
+	'''
+	try:
+		return parsedate_to_datetime(response.headers['Date']).timestamp()
+	except (KeyError, TypeError, ValueError):
+		return time.time()
+
+
+
+# Guards the index, for fetches running in several threads.
+index_lock = Lock()
+
+def read_index(cache_dir):
+	try:
+		with open(cache_dir + 'index.json') as file:
+			return json.load(file)
+	except (FileNotFoundError, ValueError):
+		return {}
+
+
+
+def write_index(cache_dir, index):
+	# Swap the index in whole so it is never half-written.
+	partial = cache_dir + f'index-{os.getpid()}.json'
+	with open(partial, 'w') as file:
+		json.dump(index, file, indent='\t')
+	os.replace(partial, cache_dir + 'index.json')
@@ -0,0 +1,277 @@
+from obtain_data import features_directory, classes_directory
+from obtain_data import load_source, load_entry
+from data_model import load_feature, load_class
+from snapshot import snapshot_key, load_snapshot, save_snapshot
+from snapshot import source_slot
+from threading import Lock
+import subprocess
+import hashlib
+import profiler
+import os
+
+
+
+def repository_url(references):
+	'''
+	This builds the clone URL of the data repository.
+	A 'url' in the references (eg. a local bare repository
+	standing in for GitHub) is used as-is instead.
+	'''
+	if references.get('url'):
+		return references['url']
+	clone_url = f'{references.get("scheme", "https")}://'
+	clone_url += f'{references["website"]}/'
+	clone_url += f'{references["account"]}/'
+	clone_url += f'{references["project"]}.git'
+	return clone_url
+
+
+
+def git(git_dir, *arguments):
+	# Run a git command against a repository; return its output.
+	command = ['git', '--git-dir', git_dir, *arguments]
+	result = subprocess.run(command, capture_output=True, check=False)
+	if result.returncode != 0:
+		raise OSError(f'{" ".join(command)}: {result.stderr.decode().strip()}')
+	return result.stdout
+
+
+
+def sync_mirror(
+	references,
+	mirror_dir = './downloads/mirrors/',
+	offline = False,
+):
+	'''
+	This keeps a bare mirror of the data repository, and
+	returns its path along with the commit its branch is at.
+	The first sync clones it; later ones only fetch objects
+	the mirror does not have yet. Offline, the mirror is used
+	as it is, and a missing mirror is an error.
+	'''
+	git_dir = mirror_dir + f'{references["project"]}.git'
+	if not os.path.isdir(git_dir):
+		if offline:
+			raise FileNotFoundError(f'no mirror at {git_dir}')
+		os.makedirs(mirror_dir, exist_ok=True)
+		command = ['git', 'clone', '--mirror', '--quiet', repository_url(references), git_dir]
+		result = subprocess.run(command, capture_output=True, check=False)
+		if result.returncode != 0:
+			raise OSError(f'{" ".join(command)}: {result.stderr.decode().strip()}')
+	elif not offline:
+		git(git_dir, 'remote', 'set-url', 'origin', repository_url(references))
+		git(git_dir, 'fetch', '--prune', '--quiet', 'origin')
+	commit = git(git_dir, 'rev-parse', f'refs/heads/{references["branch"]}^{{commit}}')
+	return git_dir, commit.decode().strip()
+
+
+
+def changed_paths(git_dir, old_commit, new_commit):
+	'''
+	This lists every path added, modified or deleted between
+	two commits, as (status letter, path) pairs.
+	Renames count as a deletion plus an addition.
+	'''
+	output = git(
+		git_dir, 'diff-tree', '-r', '-z', '--no-renames', '--name-status',
+		old_commit, new_commit,
+	)
+	fields = output.decode().split('\0')
+	return [
+		(fields[index], fields[index + 1])
+		for index in range(0, len(fields) - 1, 2)
+	]
+
+
+
+def change_set(source, version, paths):
+	'''
+	This turns changed paths into the entries they touch:
+	for classes and for features, which slugs changed (or
+	were added) and which were removed. An entry exists as
+	long as both its files do, in the given (new) source.
+	Paths outside the data of this version are listed apart.
+	The change set is plain JSON data, for any later stage.
+	'''
+	directories = {
+		'classes': classes_directory(version),
+		'features': features_directory(version),
+	}
+	changes = {
+		kind: {'changed': set(), 'removed': set()}
+		for kind in directories
+	}
+	other = []
+	for _, path in paths:
+		directory, _, filename = path.rpartition('/')
+		directory += '/'
+		kinds = [kind for kind in directories if directories[kind] == directory]
+		if not kinds:
+			other.append(path)
+			continue
+		[kind] = kinds
+		slug, _, _ = filename.rpartition('.')
+		if source.exists(directory + slug + '.json') \
+		and source.exists(directory + slug + '.md'):
+			changes[kind]['changed'].add(slug)
+		else:
+			changes[kind]['removed'].add(slug)
+
+	return {
+		**{
+			kind: {status: sorted(slugs) for status, slugs in statuses.items()}
+			for kind, statuses in changes.items()
+		},
+		'other': sorted(other),
+	}
+
+
+
+def load_delta(source, version, old_source, changes, workers = 1):
+	'''
+	This returns the (classes, features) pair of source,
+	reloading only the entries in the change set (made from
+	old_source to source) on top of old_source's snapshot.
+	The result is saved as source's own snapshot (replacing
+	old_source's), so any later load_source of the same
+	commit is instant.
+	Without an old snapshot, everything is loaded.
+	'''
+	key = snapshot_key(source.fingerprint(version), version)
+	corpus = load_snapshot(key)
+	if corpus is not None:
+		return corpus
+	old_corpus = None
+	if old_source is not None:
+		old_corpus = load_snapshot(snapshot_key(old_source.fingerprint(version), version))
+	if old_corpus is None:
+		return load_source(source, version, workers)
+
+	loaders = {'classes': load_class, 'features': load_feature}
+	directories = {
+		'classes': classes_directory(version),
+		'features': features_directory(version),
+	}
+	corpus = {}
+	for kind, entries in zip(['classes', 'features'], old_corpus):
+		entries = {**entries}
+		for slug in changes[kind]['removed']:
+			entries.pop(slug, None)
+		for slug in changes[kind]['changed']:
+			entries[slug] = load_entry(source, directories[kind], slug, loaders[kind])
+		corpus[kind] = dict(sorted(entries.items()))
+
+	corpus = (corpus['classes'], corpus['features'])
+	save_snapshot(key, corpus, slot = source_slot(source, version))
+	return corpus
+
+
+
+class GitSource:
+	'''
+	A data source backed by one commit of a git repository
+	(eg. a bare mirror; see sync_mirror). The commit's tree is
+	listed once, up front; files are read through a single
+	long-running git cat-file process. Paths given to it
+	are relative to the repository root.
+	---
+	A file's digest is its blob id, so hashing is free.
+	Like ArchiveSource, once closed (or pickled, eg. into a
+	worker process), git is started again on the next read.
+	Its name (for caches; see source_slot) is the repository,
+	whichever commit it is at.
+	'''
+	def __init__(self, git_dir, commit):
+		self.git_dir = git_dir
+		self.name = os.path.abspath(git_dir)
+		self.commit = commit
+		self.process = None
+		self.lock = Lock()
+
+		# Each blob's id and size, by path; and each directory's files.
+		self.members = {}
+		self.directories = {}
+		listing = git(git_dir, 'ls-tree', '-r', '-l', '-z', commit)
+		for record in listing.decode().split('\0'):
+			if not record:
+				continue
+			meta, _, path = record.partition('\t')
+			_, kind, blob, size = meta.split()
+			if kind != 'blob':
+				continue
+			self.members[path] = (blob, int(size))
+			directory, _, filename = path.rpartition('/')
+			directory = directory + '/' if directory else ''
+			self.directories.setdefault(directory, []).append(filename)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *error):
+		self.close()
+
+	def close(self):
+		if self.process is not None:
+			self.process.stdin.close()
+			self.process.wait()
+			self.process.stdout.close()
+			self.process = None
+
+	def __getstate__(self):
+		return {**self.__dict__, 'process': None, 'lock': None}
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.lock = Lock()
+
+	def exists(self, path):
+		return path in self.members
+
+	def fingerprint(self, version):
+		# Blob ids already hash every file's content.
+		fingerprint = hashlib.sha256()
+		top = f'source/{version}/'
+		for path in sorted(self.members):
+			if path.startswith(top):
+				blob, _ = self.members[path]
+				fingerprint.update(f'{path}\0{blob}\n'.encode())
+		return fingerprint.hexdigest()
+
+	def filenames(self, directory):
+		if directory not in self.directories:
+			raise FileNotFoundError(f'{self.commit}:{directory}')
+		return self.directories[directory]
+
+	def member(self, path):
+		member = self.members.get(path)
+		if member is None:
+			raise FileNotFoundError(f'{self.commit}:{path}')
+		return member
+
+	def digest(self, path):
+		blob, _ = self.member(path)
+		return blob
+
+	def size(self, path):
+		_, size = self.member(path)
+		return size
+
+	def read(self, path):
+		blob, size = self.member(path)
+		with self.lock:
+			if self.process is None:
+				self.process = subprocess.Popen(
+					['git', '--git-dir', self.git_dir, 'cat-file', '--batch'],
+					stdin = subprocess.PIPE,
+					stdout = subprocess.PIPE,
+				)
+			self.process.stdin.write(f'{blob}\n'.encode())
+			self.process.stdin.flush()
+			# Each answer is a header line, the content, and a newline.
+			header = self.process.stdout.readline()
+			if header.split()[-1] == b'missing':
+				raise FileNotFoundError(f'{self.commit}:{path}')
+			data = self.process.stdout.read(size)
+			self.process.stdout.read(1)
+		profiler.count('bytes read', len(data))
+		return data
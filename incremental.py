@@ -0,0 +1,228 @@
+from obtain_data import features_directory, classes_directory
+from obtain_data import load_source
+from arrange_data import arrange_class_features
+from arrange_data import compose_class_progressions
+from write_feature_descriptions import generate_descriptions
+from write_class_summaries import stream_summaries
+from lint import check
+import hashlib
+import json
+import os
+
+# Bump this whenever rendering changes, to force a full build.
+MANIFEST_FORMAT = 1
+
+
+
+def input_hashes(source, version):
+	'''
+	This hashes the inputs of every class and feature.
+	Each hash covers both the JSON and markdown files,
+	using whatever digest the source offers for each file.
+	'''
+	hashes = {}
+	directories = {
+		'classes': classes_directory(version),
+		'features': features_directory(version),
+	}
+	for kind, directory in directories.items():
+		digests = {}
+		for filename in sorted(source.filenames(directory)):
+			slug, _, _ = filename.rpartition('.')
+			if slug not in digests:
+				digests[slug] = hashlib.sha1()
+			digest = source.digest(directory + filename)
+			digests[slug].update(f'{filename}\0{digest}\n'.encode())
+		hashes[kind] = {
+			slug: digest.hexdigest()
+			for slug, digest in digests.items()
+		}
+	return hashes
+
+
+
+def dependency_edges(all_features, class_features):
+	'''
+	This lists what depends on what, as two mappings:
+	class -> the features in its progression table,
+	and child -> the parents whose descriptions include it.
+	'''
+	members = {
+		class_name: sorted(features)
+		for class_name, features in class_features.items()
+	}
+	parents = {}
+	for feature_name, feature in all_features.items():
+		for feature_class in feature.get('classes', {}).values():
+			for child_name in feature_class.get('children', {}):
+				if child_name not in parents:
+					parents[child_name] = set()
+				parents[child_name].add(feature_name)
+	parents = {
+		child_name: sorted(parent_names)
+		for child_name, parent_names in parents.items()
+	}
+	return {'classes': members, 'parents': parents}
+
+
+
+def find_stale_features(changed_features, removed_features, edges):
+	'''
+	These features need describing again: the changed ones,
+	plus the parents of changed (or removed) children.
+	'''
+	stale_features = set(changed_features)
+	# Parents include their children, so they change too.
+	for feature_name in changed_features | removed_features:
+		stale_features.update(edges['parents'].get(feature_name, []))
+	return stale_features
+
+
+
+def find_stale_classes(all_classes, edges, old_edges, changed_classes, stale_features):
+	'''
+	These classes need summarizing again: the changed ones,
+	any whose feature list changed since old_edges were made,
+	and any with a stale feature in its progression table.
+	'''
+	stale_classes = set()
+	for class_name in all_classes:
+		members = edges['classes'].get(class_name, [])
+		if class_name in changed_classes \
+		or old_edges['classes'].get(class_name) != members \
+		or not stale_features.isdisjoint(members):
+			stale_classes.add(class_name)
+	return stale_classes
+
+
+
+def rebuild_classes(all_classes, class_features, descriptions, class_names, open_sink):
+	'''
+	This composes and summarizes only the named classes,
+	streaming each summary to open_sink(class_name).
+	'''
+	class_names = sorted(class_names)
+	class_progressions = compose_class_progressions({
+		class_name: class_features[class_name]
+		for class_name in class_names
+	})
+	stream_summaries(
+		class_features,
+		class_progressions,
+		{class_name: all_classes[class_name] for class_name in class_names},
+		descriptions,
+		open_sink,
+	)
+
+
+
+def build_incrementally(
+	source,
+	version,
+	manifest,
+	open_sink,
+	output_dir = './class_summaries/',
+	workers = 1,
+	jobs = 1,
+	timings = None,
+):
+	'''
+	This rebuilds only what changed since the manifest was made.
+	A feature is re-described if its files changed, or if
+	one of its children did; a class summary is rewritten if
+	any of its features was re-described, its own files or its
+	feature list changed, or its output file has gone missing.
+	---
+	Rewritten summaries are streamed to open_sink(class_name).
+	Three things return: the classes that were rewritten,
+	the classes whose summaries should be deleted, and the
+	new manifest (to be saved once the outputs are written).
+	'''
+	hashes = input_hashes(source, version)
+	all_classes, all_features = load_source(source, version, workers, timings)
+	class_features = arrange_class_features(all_features)
+	edges = dependency_edges(all_features, class_features)
+
+	# A manifest from elsewhere counts as no manifest at all.
+	if manifest is None \
+	or manifest.get('format') != MANIFEST_FORMAT \
+	or manifest.get('version') != version:
+		manifest = {
+			'hashes': {'classes': {}, 'features': {}},
+			'edges': {'classes': {}, 'parents': {}},
+			'descriptions': {},
+		}
+	old_hashes = manifest['hashes']
+
+	# Find every feature whose description may have changed.
+	changed_features = set()
+	for feature_name, digest in hashes['features'].items():
+		if old_hashes['features'].get(feature_name) != digest:
+			changed_features.add(feature_name)
+	removed_features = old_hashes['features'].keys() - hashes['features'].keys()
+
+	stale_features = find_stale_features(changed_features, removed_features, edges)
+
+	# Find every class whose summary may have changed.
+	changed_classes = set()
+	for class_name, digest in hashes['classes'].items():
+		if old_hashes['classes'].get(class_name) != digest \
+		or not os.path.isfile(f'{output_dir}{class_name}.md'):
+			changed_classes.add(class_name)
+	stale_classes = find_stale_classes(
+		all_classes, edges, manifest['edges'], changed_classes, stale_features,
+	)
+	removed_classes = sorted(old_hashes['classes'].keys() - all_classes.keys())
+
+	# Check whatever is about to render, before any of it does.
+	check(
+		{class_name: all_classes[class_name] for class_name in stale_classes},
+		all_features,
+		only = stale_features,
+	)
+
+	# Describe the stale features; the rest come from the manifest.
+	descriptions = {
+		feature_name: manifest['descriptions'][feature_name]
+		for feature_name in all_features
+		if feature_name not in stale_features
+	}
+	render_cache = generate_descriptions(
+		all_features, descriptions, jobs = jobs, only = stale_features,
+	)
+	if timings is not None:
+		timings['render cache'] = render_cache.stats()
+
+	# Compose and summarize the stale classes alone.
+	rebuild_classes(all_classes, class_features, descriptions, stale_classes, open_sink)
+
+	# Record everything needed by the next build.
+	manifest = {
+		'format': MANIFEST_FORMAT,
+		'version': version,
+		'hashes': hashes,
+		'edges': edges,
+		'descriptions': {
+			feature_name: descriptions.get(feature_name, {})
+			for feature_name in all_features
+		},
+	}
+	return sorted(stale_classes), removed_classes, manifest
+
+
+
+def read_manifest(filepath):
+	try:
+		with open(filepath) as file:
+			return json.load(file)
+	except (FileNotFoundError, ValueError):
+		return None
+
+
+
+def write_manifest(filepath, manifest):
+	# Swap the manifest in whole so it is never half-written.
+	partial = filepath + f'.{os.getpid()}.partial'
+	with open(partial, 'w') as file:
+		json.dump(manifest, file)
+	os.replace(partial, filepath)
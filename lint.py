@@ -0,0 +1,161 @@
+from write_feature_descriptions import compile_template
+from data_model import DataProblems
+from collections.abc import Mapping
+import re
+
+# Every tag a description may use, besides its variables.
+level_tags = {'level', 'end-levels', 'all-levels', 'levels'}
+
+# The sections every class summary lists.
+required_sections = ['Prerequisites', 'Proficiencies', 'Equipment', 'Multiclassing']
+
+hit_dice_expression = re.compile(r'\d+d\d+')
+
+
+
+def lint(all_classes, all_features, only = None, classes = None, level_cap = 20):
+	'''
+	This checks the data for everything that would otherwise
+	only fail halfway through a build, and returns every
+	problem found (as a list of strings; empty if none).
+	Nothing is rendered, so this takes milliseconds.
+	---
+	Templates are tokenized once each, by compile_template,
+	the same way rendering does (so the work is not wasted).
+	Lint is a little stricter than rendering: a bad tag on
+	a line that a level tag would have deleted still counts.
+	---
+	If only is given, just those features are checked (eg.
+	those a build will render), along with their children.
+	Likewise, if classes is given, only for those classes.
+	Every class in all_classes always is.
+	'''
+	class_features = {}
+	problems = []
+	for feature_name, feature in all_features.items():
+		if only is None or feature_name in only:
+			problems += lint_feature(all_features, feature_name, feature, classes, level_cap)
+		for class_name, feature_class in feature.get('classes', {}).items():
+			if 'progression' in feature_class:
+				class_features.setdefault(class_name, []).append(feature_name)
+
+	for class_name, class_data in all_classes.items():
+		problems += lint_class(class_name, class_data)
+		if class_name not in class_features:
+			problems.append(f'class {class_name}: no feature has it in its progression')
+	# A child shared by several parents is only reported once.
+	return [*dict.fromkeys(problems)]
+
+
+
+def check(all_classes, all_features, only = None, classes = None, level_cap = 20):
+	'''
+	This lints the data (see lint), and raises every problem
+	found at once, as DataProblems. Every build calls this
+	before rendering anything.
+	'''
+	problems = lint(all_classes, all_features, only, classes, level_cap)
+	if problems:
+		raise DataProblems(problems)
+
+
+
+def lint_feature(all_features, feature_name, feature, classes = None, level_cap = 20):
+	problems = []
+	for class_name, feature_class in feature.get('classes', {}).items():
+		if classes is not None and class_name not in classes:
+			continue
+		where = f'feature {feature_name} (for {class_name})'
+		problems += lint_tags(where, feature['desc_template'], feature_class)
+
+		# Progression tables must have a level on every row.
+		progression = feature_class.get('progression')
+		if progression is not None:
+			if len(progression) == 0:
+				problems.append(f'{where}: empty progression')
+			for row in progression:
+				level = row.get('Level')
+				if not isinstance(level, int):
+					problems.append(f'{where}: progression row without a level')
+				elif 'Feature' in row and not 1 <= level <= level_cap:
+					problems.append(f'{where}: level {level} is out of range')
+
+		# Children are described for the same class, with their
+		# 	own data for it; without any, only the class tag works.
+		for child_name in feature_class.get('children', {}):
+			child = all_features.get(child_name)
+			if child is None:
+				problems.append(f'{where}: no such child feature {child_name}')
+			elif class_name in child.get('classes', {}):
+				problems += lint_tags(
+					f'feature {child_name} (for {class_name})',
+					child['desc_template'],
+					child['classes'][class_name],
+				)
+			elif 'classes' in child or template_tags(child['desc_template']) - {'class'}:
+				problems.append(f'{where}: child {child_name} lacks class {class_name}')
+	return problems
+
+
+
+def lint_tags(where, template, feature_class, expanding = ()):
+	'''
+	This checks that every tag in a template has something to
+	be replaced with, given the feature's data for a class.
+	Variable values are rendered too, so their tags count.
+	'''
+	problems = []
+	variables = feature_class.get('variables', {})
+	for tag in sorted(template_tags(template)):
+		if tag == 'class':
+			continue
+		if tag in level_tags:
+			if 'progression' not in feature_class:
+				problems.append(f'{where}: `{{( {tag} )}}` needs a progression')
+		elif tag not in variables:
+			problems.append(f'{where}: unknown tag `{{( {tag} )}}`')
+		elif tag in expanding:
+			problems.append(f'{where}: variable {tag} includes itself')
+		else:
+			problems += lint_tags(where, variables[tag], feature_class, (*expanding, tag))
+	return problems
+
+
+
+def lint_class(class_name, class_data):
+	where = f'class {class_name}'
+	problems = []
+	if 'class-features' not in template_tags(class_data['desc_template']):
+		problems.append(f'{where}: template lacks the `{{( class-features )}}` marker')
+
+	hit_dice = class_data.get('hit-dice')
+	if hit_dice is None:
+		problems.append(f'{where}: missing hit-dice')
+	elif not isinstance(hit_dice, str) or not hit_dice_expression.search(hit_dice):
+		problems.append(f'{where}: hit-dice {hit_dice!r} is not like 1d8')
+
+	structured_data = class_data.get('structured-data')
+	if not isinstance(structured_data, Mapping):
+		problems.append(f'{where}: missing structured-data')
+		return problems
+	for section in required_sections:
+		if section not in structured_data:
+			problems.append(f'{where}: structured-data lacks {section}')
+	for section, section_data in structured_data.items():
+		for group_type, groupings in section_data.items():
+			for grouping in groupings:
+				if 'selection' not in grouping or 'choose' not in grouping:
+					problems.append(
+						f'{where}: {section} {group_type} needs both selection and choose'
+					)
+	return problems
+
+
+
+def template_tags(template):
+	# Tag nodes are tuples; literal text is a string.
+	return {
+		node[0]
+		for node in compile_template(template)
+		if not isinstance(node, str)
+	}
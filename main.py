@@ -1,36 +1,558 @@
 from obtain_data import collect_data
+from obtain_data import open_source, default_references
+from incremental import build_incrementally
+from incremental import read_manifest, write_manifest
+from watch import watch
+from serve import RenderService, serve
+from multi_build import build_targets, parse_targets
+from shards import build_shard, merge_shards, parse_shard
+from lint import check
+from data_model import DataProblems
+from sqlite_export import export_sqlite
+from git_source import sync_mirror, changed_paths, change_set
+from git_source import GitSource, load_delta
+from corpus_index import load_classes
 from arrange_data import arrange_class_features
 from arrange_data import compose_class_progressions
 from write_feature_descriptions import generate_descriptions
-from write_class_summaries import generate_summaries
+from write_class_summaries import stream_summaries, table_cache
+from output_files import SummaryFiles, SummaryArchive
 
+import profiler
+import argparse
+import json
+import sys
 import os
 
-def main():
+def main(
+	offline = False,
+	workers = 1,
+	jobs = 1,
+	timings = None,
+	output_dir = './class_summaries/',
+	source_dir = None,
+	archive = None,
+	lint_only = False,
+	database = None,
+):
 	# Obtain all features, ever.
-	all_classes, all_features = collect_data()
-
-	# Ensure every feature has a description for every class.
-	generate_descriptions(all_features)
+	with profiler.stage('collect_data'):
+		all_classes, all_features = collect_data(
+			offline = offline,
+			workers = workers,
+			timings = timings,
+			local_dir = source_dir,
+			lazy = True,
+		)
 
 	# Categorized class features.
-	class_features = arrange_class_features(all_features)
+	with profiler.stage('arrange_class_features'):
+		class_features = arrange_class_features(all_features)
+
+	# Unreachable features are skipped; their templates are
+	# 	never even read (see collect_data's lazy option).
+	needed = set()
+	for features in class_features.values():
+		needed.update(features)
+
+	# Find every problem in the data now, before rendering.
+	with profiler.stage('lint'):
+		check(all_classes, all_features, only = needed)
+	if lint_only:
+		return [*all_classes]
+
+	# Ensure every feature in a class has its descriptions.
+	with profiler.stage('generate_descriptions'):
+		descriptions = {}
+		render_cache = generate_descriptions(
+			all_features, descriptions, jobs = jobs, only = needed,
+		)
+	if timings is not None:
+		timings['render cache'] = render_cache.stats()
 
 	# Create a useful progression table index for classes.
-	class_progressions = compose_class_progressions(class_features)
+	with profiler.stage('compose_class_progressions'):
+		class_progressions = compose_class_progressions(class_features)
 
-	# Create a summary for all the classes.
-	class_summaries = generate_summaries(class_features, class_progressions, all_classes)
+	# Export the compiled data for querying, if asked to.
+	if database is not None:
+		with profiler.stage('export_sqlite'):
+			export_sqlite(
+				database, all_classes, all_features,
+				class_features, class_progressions, descriptions,
+			)
 
-	return class_summaries
+	# Alternatively, stream them all into a single archive.
+	if archive is not None:
+		with profiler.stage('generate_summaries'):
+			with SummaryArchive(archive) as files:
+				stream_summaries(
+					class_features, class_progressions, all_classes, descriptions, files,
+				)
+		table_cache.prune()
+		print(f'{len(all_classes)} summaries archived', file = sys.stderr)
+		return [*all_classes]
 
-if __name__ == '__main__':
-	class_summaries = main()
+	# Write a summary for all the classes, one at a time.
+	# Only changed summaries are written; gone classes removed.
+	files = SummaryFiles(output_dir)
+	with profiler.stage('generate_summaries'):
+		stream_summaries(
+			class_features, class_progressions, all_classes, descriptions, files,
+		)
+		files.prune(all_classes)
+		table_cache.prune()
+	report_summaries(files)
+
+	return [*all_classes]
+
+def main_incremental(
+	offline = False,
+	workers = 1,
+	jobs = 1,
+	timings = None,
+	output_dir = './class_summaries/',
+	source_dir = None,
+	manifest_path = './downloads/build-manifest.json',
+):
+	# Only rebuild what changed since the last build.
+	files = SummaryFiles(output_dir)
+	source = open_source(offline = offline, local_dir = source_dir)
+	with source:
+		with profiler.stage('build_incrementally'):
+			written_classes, removed_classes, manifest = build_incrementally(
+				source,
+				default_references['version'],
+				read_manifest(manifest_path),
+				files,
+				output_dir = output_dir,
+				workers = workers,
+				jobs = jobs,
+				timings = timings,
+			)
+	for class_name in removed_classes:
+		files.remove(class_name)
+	write_manifest(manifest_path, manifest)
+	report_summaries(files)
+	return written_classes
+
+def main_only(
+	class_names,
+	offline = False,
+	workers = 1,
+	jobs = 1,
+	timings = None,
+	output_dir = './class_summaries/',
+	source_dir = None,
+):
+	# Load only what these classes need, using the index.
+	source = open_source(offline = offline, local_dir = source_dir)
+	with source:
+		with profiler.stage('collect_data'):
+			all_classes, all_features = load_classes(
+				source, default_references['version'], class_names, workers,
+			)
+
+	# Describe only these classes' features, for these classes.
+	with profiler.stage('arrange_class_features'):
+		class_features = arrange_class_features(all_features)
+	needed = set()
+	for class_name in class_names:
+		needed.update(class_features.get(class_name, {}))
+	with profiler.stage('lint'):
+		check(all_classes, all_features, only = needed, classes = class_names)
+	with profiler.stage('generate_descriptions'):
+		descriptions = {}
+		render_cache = generate_descriptions(
+			all_features, descriptions,
+			jobs = jobs, only = needed, classes = class_names,
+		)
+	if timings is not None:
+		timings['render cache'] = render_cache.stats()
+
+	with profiler.stage('compose_class_progressions'):
+		class_progressions = compose_class_progressions({
+			class_name: class_features[class_name]
+			for class_name in class_names
+		})
+	files = SummaryFiles(output_dir)
+	with profiler.stage('generate_summaries'):
+		stream_summaries(
+			class_features, class_progressions, all_classes, descriptions, files,
+		)
+	report_summaries(files)
+
+	return [*all_classes]
+
+def main_watch(
+	offline = False,
+	workers = 1,
+	jobs = 1,
+	timings = None,
+	output_dir = './class_summaries/',
+	source_dir = None,
+):
+	# Watching needs plain files; extract the data if need be.
+	source = open_source(
+		offline = offline,
+		extract = source_dir is None,
+		local_dir = source_dir,
+	)
+	files = SummaryFiles(output_dir)
 	try:
-		os.makedirs('./class_summaries/')
-	except:
+		watch(
+			source,
+			default_references['version'],
+			files,
+			files.remove,
+			jobs = jobs,
+		)
+	except KeyboardInterrupt:
 		pass
-	for class_name, summary in class_summaries.items():
-		filepath = f'./class_summaries/{class_name}.md'
-		with open(filepath, 'w') as file:
-			file.write(summary)
+
+def main_serve(
+	port,
+	offline = False,
+	workers = 1,
+	jobs = 1,
+	timings = None,
+	source_dir = None,
+):
+	# Load the corpus once; render on request, from then on.
+	# Reloading fetches the data again (unless offline).
+	def load():
+		return collect_data(
+			offline = offline,
+			workers = workers,
+			local_dir = source_dir,
+		)
+	try:
+		serve(RenderService(load), port = port)
+	except KeyboardInterrupt:
+		pass
+
+def main_targets(
+	targets,
+	offline = False,
+	workers = 1,
+	jobs = 1,
+	timings = None,
+	output_dir = './class_summaries/',
+	source_dir = None,
+):
+	# Build several branches and versions, sharing their work.
+	# Each target gets its own tree, under output_dir.
+	if source_dir is not None:
+		raise ValueError('targets are always downloaded; drop --source')
+	return build_targets(
+		targets,
+		output_dir,
+		offline = offline,
+		workers = max(workers, len(targets)),
+		report = lambda line: print(line, file = sys.stderr),
+		jobs = jobs,
+	)
+
+def main_git(
+	offline = False,
+	workers = 1,
+	jobs = 1,
+	timings = None,
+	output_dir = './class_summaries/',
+	git_url = None,
+	manifest_path = './downloads/build-manifest.json',
+	change_set_path = './downloads/change-set.json',
+):
+	# Sync a mirror of the data; reload only what changed
+	# 	since the commit last built, then rebuild incrementally.
+	references = {**default_references}
+	if git_url is not None:
+		references['url'] = git_url
+	version = references['version']
+	git_dir, commit = sync_mirror(references, offline = offline)
+	manifest = read_manifest(manifest_path)
+	old_commit = (manifest or {}).get('commit')
+
+	files = SummaryFiles(output_dir)
+	with GitSource(git_dir, commit) as source:
+		changes = None
+		old_source = None
+		if old_commit is not None and old_commit != commit:
+			try:
+				old_source = GitSource(git_dir, old_commit)
+				paths = changed_paths(git_dir, old_commit, commit)
+			except OSError:
+				# The old commit is gone (eg. after a force push).
+				old_source = None
+			else:
+				changes = change_set(source, version, paths)
+				changes = {'from': old_commit, 'to': commit, **changes}
+		with profiler.stage('load_delta'):
+			empty = {'changed': [], 'removed': []}
+			load_delta(
+				source, version, old_source,
+				changes or {'classes': empty, 'features': empty},
+				workers,
+			)
+		with profiler.stage('build_incrementally'):
+			written_classes, removed_classes, manifest = build_incrementally(
+				source,
+				version,
+				manifest,
+				files,
+				output_dir = output_dir,
+				workers = workers,
+				jobs = jobs,
+				timings = timings,
+			)
+	for class_name in removed_classes:
+		files.remove(class_name)
+	manifest['commit'] = commit
+	write_manifest(manifest_path, manifest)
+	if changes is not None:
+		write_manifest(change_set_path, changes)
+		print(
+			f'{old_commit[:12]}..{commit[:12]}:'
+			f' {len(changes["features"]["changed"])} features changed,'
+			f' {len(changes["features"]["removed"])} removed;'
+			f' {len(changes["classes"]["changed"])} classes changed,'
+			f' {len(changes["classes"]["removed"])} removed',
+			file = sys.stderr,
+		)
+	report_summaries(files)
+	return written_classes
+
+def main_shard(
+	shard,
+	count,
+	offline = False,
+	workers = 1,
+	jobs = 1,
+	timings = None,
+	shard_dir = './shards/',
+	source_dir = None,
+):
+	# Build only this shard's classes, balanced by their size.
+	source = open_source(offline = offline, local_dir = source_dir)
+	with source:
+		with profiler.stage('build_shard'):
+			manifest = build_shard(
+				source,
+				default_references['version'],
+				shard,
+				count,
+				shard_dir,
+				workers = workers,
+				jobs = jobs,
+			)
+	print(
+		f'shard {shard}/{count}: {len(manifest["summaries"])} summaries,'
+		f' cost {manifest["cost"]}',
+		file = sys.stderr,
+	)
+	return [*manifest['summaries']]
+
+def main_merge(shard_dir = './shards/', output_dir = './class_summaries/'):
+	# Check every shard, then assemble their summaries.
+	with profiler.stage('merge_shards'):
+		files = merge_shards(shard_dir, output_dir)
+	report_summaries(files)
+
+def report_summaries(files):
+	stats = files.stats()
+	print(
+		f'{stats["written"]} summaries written, '
+		f'{stats["skipped"]} unchanged, '
+		f'{stats["removed"]} removed',
+		file = sys.stderr,
+	)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument(
+		'--offline',
+		action = 'store_true',
+		help = 'never touch the network; use the cached data only',
+	)
+	parser.add_argument(
+		'--workers',
+		type = int,
+		default = 1,
+		help = 'number of threads reading the data files',
+	)
+	parser.add_argument(
+		'--jobs',
+		type = int,
+		default = 1,
+		help = 'number of processes rendering feature descriptions',
+	)
+	parser.add_argument(
+		'--timings',
+		action = 'store_true',
+		help = 'print loading phase timings and render cache counters',
+	)
+	parser.add_argument(
+		'--profile',
+		metavar = 'FILE',
+		help = 'save a JSON profile of stages, renders and counters',
+	)
+	parser.add_argument(
+		'--chrome-trace',
+		metavar = 'FILE',
+		help = 'save a Chrome trace-event file of the same',
+	)
+	parser.add_argument(
+		'--incremental',
+		action = 'store_true',
+		help = 'only rebuild the summaries affected by changed data',
+	)
+	parser.add_argument(
+		'--only',
+		metavar = 'CLASS,...',
+		help = 'only build the summaries of these classes',
+	)
+	parser.add_argument(
+		'--watch',
+		action = 'store_true',
+		help = 'keep rebuilding affected summaries as the data changes',
+	)
+	parser.add_argument(
+		'--source',
+		metavar = 'DIR',
+		help = 'read a local checkout of the data repository instead',
+	)
+	parser.add_argument(
+		'--serve',
+		metavar = 'PORT',
+		type = int,
+		help = 'serve summaries, descriptions and tables over local HTTP',
+	)
+	parser.add_argument(
+		'--targets',
+		metavar = 'BRANCH:VERSION,...',
+		help = 'build several branches and versions, each into its own folder',
+	)
+	parser.add_argument(
+		'--shard',
+		metavar = 'K/N',
+		help = 'only build shard K of N (balanced by data size), into --shard-dir',
+	)
+	parser.add_argument(
+		'--merge',
+		action = 'store_true',
+		help = 'check every shard in --shard-dir, then assemble the summaries',
+	)
+	parser.add_argument(
+		'--shard-dir',
+		metavar = 'DIR',
+		default = './shards/',
+		help = 'where shards are built and merged from (default: ./shards/)',
+	)
+	parser.add_argument(
+		'--lint',
+		action = 'store_true',
+		help = 'only check the data for problems, without building',
+	)
+	parser.add_argument(
+		'--git',
+		action = 'store_true',
+		help = 'sync a git mirror of the data, and rebuild only what changed',
+	)
+	parser.add_argument(
+		'--git-url',
+		metavar = 'URL',
+		help = 'clone the data from URL instead (eg. a local bare repository)',
+	)
+	parser.add_argument(
+		'--sqlite',
+		metavar = 'FILE',
+		help = 'also export classes, tables and descriptions to a SQLite database',
+	)
+	parser.add_argument(
+		'--archive',
+		metavar = 'FILE',
+		help = 'stream every summary into one zip, indexed in FILE.json',
+	)
+	arguments = parser.parse_args()
+	if arguments.lint and (
+		arguments.watch or arguments.only or arguments.incremental
+		or arguments.targets or arguments.serve is not None
+		or arguments.shard or arguments.merge or arguments.git
+		or arguments.archive or arguments.sqlite
+	):
+		parser.error('--lint only checks the data; it cannot be combined with a build')
+	if (arguments.archive or arguments.sqlite) and (
+		arguments.watch or arguments.only or arguments.incremental
+		or arguments.targets or arguments.serve is not None
+		or arguments.shard or arguments.merge or arguments.git
+	):
+		parser.error('--archive and --sqlite only work with a full build')
+
+	timings = {}
+	options = {
+		'offline': arguments.offline,
+		'workers': arguments.workers,
+		'jobs': arguments.jobs,
+		'timings': timings,
+		'source_dir': arguments.source,
+	}
+	if arguments.profile or arguments.chrome_trace:
+		profiler.start()
+	# Reuse the progression tables of unchanged classes.
+	table_cache.persist('./downloads/tables/')
+	if arguments.shard:
+		try:
+			shard, count = parse_shard(arguments.shard)
+		except ValueError as error:
+			parser.error(str(error))
+	if arguments.targets:
+		try:
+			targets = parse_targets(arguments.targets)
+		except ValueError as error:
+			parser.error(str(error))
+		if arguments.source:
+			parser.error('targets are always downloaded; drop --source')
+	if arguments.git and arguments.source:
+		parser.error('--git cannot be used with --source')
+	# Problems in the data (see lint.check) or in the shards
+	# 	are reported all at once, without a traceback.
+	try:
+		if arguments.merge:
+			main_merge(os.path.join(arguments.shard_dir, ''))
+		elif arguments.shard:
+			main_shard(
+				shard, count, **options,
+				shard_dir = os.path.join(arguments.shard_dir, ''),
+			)
+		elif arguments.git:
+			options.pop('source_dir')
+			main_git(**options, git_url = arguments.git_url)
+		elif arguments.serve is not None:
+			main_serve(arguments.serve, **options)
+		elif arguments.targets:
+			main_targets(targets, **options)
+		elif arguments.watch:
+			main_watch(**options)
+		elif arguments.only:
+			try:
+				main_only(arguments.only.split(','), **options)
+			except KeyError as error:
+				sys.exit(error.args[0])
+		elif arguments.incremental:
+			main_incremental(**options)
+		else:
+			main(
+				**options,
+				archive = arguments.archive,
+				lint_only = arguments.lint,
+				database = arguments.sqlite,
+			)
+	except DataProblems as error:
+		sys.exit(str(error))
+	if arguments.timings:
+		timings['table cache'] = table_cache.stats()
+		print(json.dumps(timings, indent='\t'), file=sys.stderr)
+	if arguments.profile:
+		profiler.write_report(arguments.profile)
+	if arguments.chrome_trace:
+		profiler.write_chrome_trace(arguments.chrome_trace)
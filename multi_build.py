@@ -0,0 +1,186 @@
+from obtain_data import open_source, default_references
+from obtain_data import features_directory, classes_directory
+from obtain_data import load_entry
+from data_model import load_feature, load_class, DataProblems
+from download_cache import archive_url, fetch_archive
+from incremental import input_hashes
+from arrange_data import arrange_class_features
+from arrange_data import compose_class_progressions
+from write_feature_descriptions import generate_descriptions
+from write_feature_descriptions import RenderCache
+from write_class_summaries import stream_summaries
+from output_files import SummaryFiles
+from lint import lint
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+
+
+def parse_targets(text, references = default_references):
+	'''
+	This turns 'branch:version,...' into a list of references,
+	each a copy of the given references with those two replaced.
+	'''
+	targets = []
+	for target in text.split(','):
+		branch, _, version = target.partition(':')
+		if not branch or not version:
+			raise ValueError(f'expected branch:version, not {target!r}')
+		targets.append({**references, 'branch': branch, 'version': version})
+	return targets
+
+
+
+def target_name(references):
+	return f'{references["branch"]}-{references["version"]}'
+
+
+
+def build_targets(
+	targets,
+	output_dir = './class_summaries/',
+	offline = False,
+	workers = 1,
+	report = print,
+	jobs = 1,
+):
+	'''
+	This builds the summaries of several targets (branches and
+	versions of the data), each into its own output tree:
+	output_dir/<branch>-<version>/. It returns the
+	(written, skipped, removed) counts of each target.
+	---
+	Archives are fetched, and their entries loaded, in a pool
+	of threads (workers), one target per thread; targets on
+	the same branch share one archive, fetched only once.
+	Targets are mostly identical, so work is shared across
+	them by content: an entry whose files match one seen in
+	another target is only parsed once, and the very same
+	(immutable) record is used by both (see EntryCache);
+	likewise a description is only rendered once per distinct
+	feature and class (see RenderCache), and, with more than
+	one job, only new descriptions go to the process pool.
+	Results are identical to separate builds.
+	'''
+	entries = EntryCache()
+	renders = {}
+	described = {}
+
+	def load(references):
+		source = open_source(references, redownload = False, offline = offline)
+		with source:
+			return entries.load(source, references['version'])
+
+	with ThreadPoolExecutor(max(1, workers)) as pool:
+		if not offline:
+			urls = {archive_url(references): references for references in targets}
+			list(pool.map(fetch_archive, urls.values()))
+		loaded = list(pool.map(load, targets))
+
+	# Check every target before rendering any of them.
+	problems = []
+	for references, (all_classes, all_features, _) in zip(targets, loaded):
+		for problem in lint(all_classes, all_features):
+			problems.append(f'{target_name(references)}: {problem}')
+	if problems:
+		raise DataProblems(problems)
+
+	results = {}
+	for references, (all_classes, all_features, keys) in zip(targets, loaded):
+		cache = RenderCache(renders, keys)
+		descriptions = {}
+		signatures = description_signatures(all_features, keys)
+		fresh = set()
+		reused = 0
+		for (feature_name, class_name), signature in signatures.items():
+			if signature in described:
+				descriptions.setdefault(feature_name, {})[class_name] = described[signature]
+				reused += 1
+			else:
+				fresh.add(feature_name)
+		generate_descriptions(
+			all_features, descriptions, jobs = jobs, cache = cache, only = fresh,
+		)
+		for (feature_name, class_name), signature in signatures.items():
+			described.setdefault(signature, descriptions[feature_name][class_name])
+		class_features = arrange_class_features(all_features)
+		class_progressions = compose_class_progressions(class_features)
+
+		files = SummaryFiles(output_dir + target_name(references) + '/')
+		stream_summaries(
+			class_features, class_progressions, all_classes, descriptions, files,
+		)
+		files.prune(all_classes)
+
+		name = target_name(references)
+		results[name] = files.stats()
+		report(
+			f'{name}: {results[name]["written"]} written,'
+			f' {results[name]["skipped"]} unchanged,'
+			f' {results[name]["removed"]} removed'
+			f' ({reused} shared descriptions, {cache.hits} shared renders)'
+		)
+	return results
+
+
+
+def description_signatures(all_features, keys):
+	'''
+	This gives each (feature, class) pair what its description
+	depends on: the content of the feature and its children.
+	Pairs with equal signatures have the same description.
+	'''
+	signatures = {}
+	for feature_name, feature in all_features.items():
+		for class_name, feature_class in feature.get('classes', {}).items():
+			children = tuple(keys[child] for child in feature_class.get('children', ()))
+			signatures[feature_name, class_name] = (keys[feature_name], class_name, children)
+	return signatures
+
+
+
+class EntryCache:
+	'''
+	This holds parsed entries by content: (kind, slug, hash of
+	its files), as given by input_hashes. Loading an entry seen
+	before (in any source) just reuses the parsed record.
+	'''
+	def __init__(self):
+		self.entries = {}
+		self.lock = Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def load(self, source, version):
+		'''
+		This returns (classes, features, keys) for a source,
+		where keys map each feature to its content key.
+		'''
+		hashes = input_hashes(source, version)
+		directories = {
+			'classes': classes_directory(version),
+			'features': features_directory(version),
+		}
+		loaders = {'classes': load_class, 'features': load_feature}
+		corpus = {}
+		for kind, directory in directories.items():
+			corpus[kind] = {}
+			for slug, digest in sorted(hashes[kind].items()):
+				key = (kind, slug, digest)
+				with self.lock:
+					entry = self.entries.get(key)
+					if entry is None:
+						self.misses += 1
+					else:
+						self.hits += 1
+				if entry is None:
+					entry = load_entry(source, directory, slug, loaders[kind])
+					with self.lock:
+						entry = self.entries.setdefault(key, entry)
+				corpus[kind][slug] = entry
+		keys = {
+			slug: ('features', slug, digest)
+			for slug, digest in hashes['features'].items()
+		}
+		return corpus['classes'], corpus['features'], keys
+
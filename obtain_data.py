@@ -1,22 +1,46 @@
 from functools import reduce
-from zipfile import ZipFile
+from zipfile import ZipFile, BadZipFile
+from zipfile import ZIP_STORED, ZIP_DEFLATED
 from io import BytesIO
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from time import perf_counter
+from download_cache import archive_url, fetch_archive
+from snapshot import snapshot_key, load_snapshot, save_snapshot
+from snapshot import source_slot
+from data_model import Deferred, DataProblems, load_feature, load_class, freeze
+import profiler
+import hashlib
+import struct
+import mmap
+import zlib
 import json
 import os
 import re
 
 
 
+# The data repository, branch and version used by default.
+default_references = {
+	'website': 'github.com',
+	'account': 'mythril-forge',
+	'project': 'character-data',
+	'branch': 'dev',
+	'version': 'homebrew',
+}
+
+
+
 def collect_data(
-	references = {
-		'website': 'github.com',
-		'account': 'mythril-forge',
-		'project': 'character-data',
-		'branch': 'dev',
-		'version': 'homebrew',
-	},
+	references = default_references,
 	redownload = True,
+	extract = False,
+	offline = False,
+	workers = 1,
+	timings = None,
+	snapshot = True,
+	local_dir = None,
+	lazy = False,
 ):
 	'''
 	This is the root of every function presented here.
@@ -24,120 +48,554 @@ def collect_data(
 	Otherwise, it will simply use the JSON data on-file.
 	This function then returns a python object of that data.
 	---
+	Finding the data is up to open_source (see there),
+	and reading it is up to load_source (see there).
+	---
 	This function is specifically designed for class features.
 	'''
+	source = open_source(references, redownload, extract, offline, local_dir)
+	with source:
+		return load_source(
+			source, references['version'], workers, timings, snapshot, lazy,
+		)
+
+
+
+def open_source(
+	references = default_references,
+	redownload = True,
+	extract = False,
+	offline = False,
+	local_dir = None,
+):
+	'''
+	This returns a source to read the data repository from.
+	A local_dir (eg. a checkout of the data repository)
+	is used as-is, and nothing is downloaded at all.
+	---
+	By default the downloaded zip is kept whole on disk, and
+	every member is read straight out of the (memory-mapped)
+	archive; nothing is extracted. Passing extract=True uses
+	the older extracted-directory layout instead. If only an
+	extracted directory exists, it is used as a fallback.
+	---
+	Archives live in a download cache (see download_cache).
+	With redownload set, the cache asks upstream whether the
+	archive changed; offline, the network is never touched.
+	'''
+	if local_dir is not None:
+		return DirectorySource(os.path.join(local_dir, ''))
+
 	# Make a copy of the references object
 	# 	in case its ever changed.
 	references = {**references}
 
 	# Determine repository download URL.
-	download_url = 'https://'
-	download_url += f'{references["website"]}/'
-	download_url += f'{references["account"]}/'
-	download_url += f'{references["project"]}/'
-	download_url += 'archive/'
-	download_url += f'{references["branch"]}.zip'
+	download_url = archive_url(references)
 
 	# Determine downloaded file reference.
 	download_dir = './downloads/' # /archive-*...?
 	download_dir += f'{references["project"]}-'
 	download_dir += f'{references["branch"]}/'
 
-	if redownload or not os.path.isdir(download_dir):
-		# Download a zip of the data repository; extract it.
-		request = requests.get(download_url, stream=True)
-		zip = ZipFile(BytesIO(request.content))
-		zip.extractall('./downloads/')
+	# GitHub archives nest everything in one root folder.
+	archive_root = download_dir[len('./downloads/'):]
 
+	if extract:
+		if offline and not os.path.isdir(download_dir):
+			raise FileNotFoundError(f'no extracted copy at {download_dir}')
+		if not offline and (redownload or not os.path.isdir(download_dir)):
+			# Download a zip of the data repository; extract it.
+			import requests
+			request = requests.get(download_url, stream=True)
+			zip = ZipFile(BytesIO(request.content))
+			zip.extractall('./downloads/')
+		source = DirectorySource(download_dir)
 
-	def collect_features():
-		# Determine feature data directory reference.
-		features_dir = download_dir
-		features_dir += 'source/'
-		features_dir += f'{references["version"]}/'
-		features_dir += 'abilities/features/'
+	else:
+		# An extracted copy stands in for a missing archive,
+		# 	as long as nothing asked for a fresh download.
+		local_only = offline
+		local_only |= not redownload and os.path.isdir(download_dir)
+		try:
+			# Use the download cache; only fetch what changed.
+			download_path = fetch_archive(
+				references,
+				redownload = redownload,
+				offline = local_only,
+			)
+			source = ArchiveSource(download_path, archive_root)
+		except FileNotFoundError:
+			# Nothing cached, but an extracted copy may exist.
+			if not os.path.isdir(download_dir):
+				raise
+			source = DirectorySource(download_dir)
+
+	return source
 
-		# Create slugs from walking the features_dir.
-		# The slugs are meant to have no file extention.
-		def make_slugs(feature_names, filename):
-			expression = r'^(.*)(?=\.(.+))'
-			feature_name = re.match(expression, filename)
-			feature_names.add(feature_name.group())
-			return feature_names
 
-		# Use this reducer to create a set of all features.
-		_, _, filenames = next(os.walk(features_dir))
-		feature_names = reduce(make_slugs, filenames, set([]))
 
-		# Create base features dictionary object.
-		features = {} # *this will be returned later*
+def load_source(
+	source,
+	version,
+	workers = 1,
+	timings = None,
+	snapshot = True,
+	lazy = False,
+):
+	'''
+	This returns the (classes, features) pair of a source.
+	---
+	If lazy is set, only features reachable from some class
+	(according to the corpus index) have their templates read
+	up front; every other feature's template is a LazyTemplate,
+	read only if it is ever asked for.
+	---
+	Files are read by the given number of worker threads,
+	and loading phase timings go into timings (if given).
+	---
+	Unless snapshot is unset, the parsed corpus is saved to
+	a snapshot keyed by a hash of the source tree, and later
+	runs over the same tree load that snapshot instead.
+	Only the latest snapshot of each source is kept.
+	'''
+	eager = None
+	if lazy:
+		# The index imports this module, so import it late.
+		from corpus_index import load_index
+		eager = load_index(source, version)['reachable']
 
-		# Loop through all the features.
-		for feature_name in feature_names:
+	# Reuse the parsed corpus, if this exact tree was seen.
+	if snapshot:
+		started = perf_counter()
+		variant = version + ('/lazy' if lazy else '')
+		key = snapshot_key(source.fingerprint(version), variant)
+		corpus = load_snapshot(key)
+		if corpus is not None:
+			classes, features = corpus
+			rebind_templates(features, source)
+			if timings is not None:
+				timings['snapshot'] = perf_counter() - started
+			return classes, features
 
-			# Get data.
-			filepath = features_dir + feature_name + '.json'
-			with open(filepath) as file:
-				feature_data = json.load(file)
+	classes, features = load_corpus(source, version, workers, timings, eager)
+	if snapshot:
+		save_snapshot(key, (classes, features), slot = source_slot(source, variant))
+	return classes, features
 
-			# Get markdown description template.
-			filepath = features_dir + feature_name + '.md'
-			with open(filepath) as file:
-				template = file.read()
 
-			# Combine for full feature data summary.
-			feature_data['desc_template'] = template
-			# Add to features dictionary.
-			features[feature_name] = feature_data
 
-		# Return populated features dictionary.
-		return features
+def load_corpus(source, version, workers = 1, timings = None, eager = None):
+	'''
+	This reads every class and feature from a data source.
+	The source may be a directory or an archive (see below).
+	Both the classes and features dictionaries are returned,
+	of ClassData and Feature records (see data_model).
+	---
+	With more than one worker, files are read concurrently.
+	If a timings dictionary is given, the seconds spent in
+	each loading phase are recorded into it, per directory.
+	If eager is given, only those features' templates are
+	read now; the rest are read lazily (see LazyTemplate).
+	'''
+	if timings is None:
+		timings = {}
 
+	def collect_features():
+		timings['features'] = {}
+		return collect_entries(
+			source, features_directory(version), workers, timings['features'],
+			eager = eager, load = load_feature,
+		)
 
 	def collect_classes():
-		# Determine feature data directory reference.
-		classes_dir = download_dir
-		classes_dir += 'source/'
-		classes_dir += f'{references["version"]}/'
-		classes_dir += 'vocations/classes/'
+		timings['classes'] = {}
+		return collect_entries(
+			source, classes_directory(version), workers, timings['classes'],
+			load = load_class,
+		)
+
+	classes = collect_classes()
+	features = collect_features()
+	return classes, features
+
+
+
+def features_directory(version):
+	# Determine feature data directory reference.
+	features_dir = 'source/'
+	features_dir += f'{version}/'
+	features_dir += 'abilities/features/'
+	return features_dir
+
 
-		# Create slugs from walking the classes_dir.
-		# The slugs are meant to have no file extention.
-		def make_slugs(class_names, filename):
-			expression = r'^(.*)(?=\.(.+))'
-			class_name = re.match(expression, filename)
-			class_names.add(class_name.group())
-			return class_names
 
-		# Use this reducer to create a set of all classes.
-		_, _, filenames = next(os.walk(classes_dir))
-		class_names = reduce(make_slugs, filenames, set([]))
+def classes_directory(version):
+	# Determine class data directory reference.
+	classes_dir = 'source/'
+	classes_dir += f'{version}/'
+	classes_dir += 'vocations/classes/'
+	return classes_dir
 
-		# Create base classes dictionary object.
-		classes = {} # *this will be returned later*
 
-		# Loop through all the classes.
-		for class_name in class_names:
 
-			# Get data.
-			filepath = classes_dir + class_name + '.json'
-			with open(filepath) as file:
-				class_data = json.load(file)
+def collect_entries(
+	source,
+	directory,
+	workers = 1,
+	timings = None,
+	only = None,
+	eager = None,
+	load = freeze,
+):
+	'''
+	Every entry in a data directory is a pair of files:
+	a JSON file with its data, and a markdown template.
+	This combines each pair into one dictionary, keyed by slug.
+	If only is given, just those slugs are read; the
+	directory is not even listed. If eager is given, only
+	those slugs have their templates read now; the others
+	get a LazyTemplate, read on first access. Each entry is
+	made into a record by load (eg. load_feature).
+	---
+	Files are read by a pool of workers (see read_entries),
+	but always parsed and added here, in sorted slug order;
+	the result is identical no matter how many workers run.
+	Timings are kept for the list, read and parse phases,
+	plus the wall-clock time of the whole directory.
+	'''
+	if timings is None:
+		timings = {}
+	started = perf_counter()
 
-			# Get markdown description template.
-			filepath = classes_dir + class_name + '.md'
-			with open(filepath) as file:
-				template = file.read()
+	# Create slugs from listing the directory.
+	# The slugs are meant to have no file extention.
+	def make_slugs(slugs, filename):
+		expression = r'^(.*)(?=\.(.+))'
+		slug = re.match(expression, filename)
+		slugs.add(slug.group())
+		return slugs
 
-			# Combine for full class data summary.
-			class_data['desc_template'] = template
+	# Use this reducer to create a set of all entries.
+	if only is None:
+		filenames = source.filenames(directory)
+		slugs = reduce(make_slugs, filenames, set([]))
+	else:
+		slugs = set(only)
+	slugs = sorted(slugs)
+	timings['list'] = perf_counter() - started
+	timings['read'] = 0.0
+	timings['parse'] = 0.0
 
-			# Add to classes dictionary.
-			classes[class_name] = class_data
+	# Parse entries in whichever order their reads finish.
+	parsed = {}
+	for slug, data, template, read_time in \
+			read_entries(source, directory, slugs, workers, eager):
+		timings['read'] += read_time
+		parse_started = perf_counter()
 
-		# Return populated classes dictionary.
-		return classes
+		if template is None:
+			template = LazyTemplate(source, directory + slug + '.md')
+		parsed[slug] = parse_entry(data, template, load, directory + slug + '.json')
 
-	classes = collect_classes()
-	features = collect_features()
-	return classes, features
+		timings['parse'] += perf_counter() - parse_started
+
+	# Create entries dictionary object, in a stable order.
+	entries = {slug: parsed[slug] for slug in slugs}
+
+	# Return populated entries dictionary.
+	timings['wall'] = perf_counter() - started
+	return entries
+
+
+
+def load_entry(source, directory, slug, load = freeze):
+	'''
+	This reads and parses a single entry of a data directory.
+	'''
+	path = directory + slug + '.json'
+	data = source.read(path)
+	template = source.read(directory + slug + '.md')
+	return parse_entry(data, template, load, path)
+
+
+
+def parse_entry(data, template, load = freeze, path = '<entry>'):
+	# Get data.
+	entry = parse_json(data, path)
+	# Combine with the markdown description template.
+	if not isinstance(template, Deferred):
+		template = read_text(template)
+	entry['desc_template'] = template
+	# Make it a record; nothing changes it from here on.
+	return load(entry)
+
+
+
+def parse_json(data, path):
+	# Bad JSON is a problem in the data; say which file.
+	try:
+		return json.loads(data)
+	except ValueError as error:
+		raise DataProblems([f'{path}: {error}'], 'cannot parse the data')
+
+
+
+def read_entries(source, directory, slugs, workers = 1, eager = None):
+	'''
+	This yields the raw files of each entry, as a tuple of
+	(slug, JSON bytes, markdown bytes, seconds spent reading).
+	Templates are skipped (None) for slugs not in eager,
+	when eager is given.
+	---
+	A single worker reads serially, in slug order.
+	Otherwise a thread pool does the reads, handing results
+	over through a bounded queue; readers wait whenever the
+	parser falls behind, so memory stays bounded too.
+	Results then arrive in no particular order.
+	'''
+	if eager is not None:
+		eager = set(eager)
+	def read_entry(slug):
+		started = perf_counter()
+		data = source.read(directory + slug + '.json')
+		template = None
+		if eager is None or slug in eager:
+			template = source.read(directory + slug + '.md')
+		return slug, data, template, perf_counter() - started
+
+	if workers <= 1:
+		for slug in slugs:
+			yield read_entry(slug)
+		return
+
+	# Readers report failures through the queue as well,
+	# 	so the parser never waits on a read that died.
+	pending = Queue(maxsize = workers * 4)
+	def reader(slug):
+		try:
+			pending.put((None, read_entry(slug)))
+		except BaseException as error:
+			pending.put((error, None))
+
+	pool = ThreadPoolExecutor(workers)
+	futures = [pool.submit(reader, slug) for slug in slugs]
+	try:
+		for _ in slugs:
+			error, result = pending.get()
+			if error is not None:
+				raise error
+			yield result
+	finally:
+		# Stop early readers; unblock any stuck on a full queue.
+		pool.shutdown(wait = False, cancel_futures = True)
+		while not all(future.done() for future in futures):
+			try:
+				pending.get(timeout = 0.01)
+			except Empty:
+				pass
+
+
+
+def read_text(data):
+	'''
+	Decodes raw file bytes the same way open() would read them:
+	as utf-8 text, with every line ending turned into '\\n'.
+	'''
+	text = data.decode('utf-8')
+	return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+
+def rebind_templates(features, source):
+	'''
+	Unread templates in a snapshot still point at the source
+	they were first loaded from; but the same tree may since
+	have moved (or been copied) elsewhere. This points them
+	at the given source, which the snapshot was found for.
+	'''
+	for feature in features.values():
+		template = feature.cells[feature.fields['desc_template']]
+		if isinstance(template, LazyTemplate):
+			template.source = source
+
+
+
+class LazyTemplate(Deferred):
+	'''
+	A markdown template, read from its source on first lookup
+	(see Deferred). Pickles (for snapshots and worker processes)
+	keep an unread template unread, along with where it lives.
+	'''
+	def __init__(self, source, path):
+		self.source = source
+		self.path = path
+		self.text = None
+
+	def resolve(self):
+		if self.text is None:
+			self.text = read_text(self.source.read(self.path))
+		return self.text
+
+
+
+class DirectorySource:
+	'''
+	A data source backed by an extracted folder on disk.
+	Paths given to it are relative to the repository root.
+	Its name (for caches; see source_slot) is that root.
+	'''
+	def __init__(self, root):
+		self.root = root
+		self.name = os.path.abspath(root)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *error):
+		pass
+
+	def filenames(self, directory):
+		_, _, filenames = next(os.walk(self.root + directory))
+		return filenames
+
+	def fingerprint(self, version):
+		# Sizes and modification times stand in for content;
+		# 	hashing every file would defeat the purpose.
+		fingerprint = hashlib.sha256()
+		top = self.root + f'source/{version}/'
+		for directory, folders, filenames in os.walk(top):
+			folders.sort()
+			for filename in sorted(filenames):
+				path = os.path.join(directory, filename)
+				stat = os.stat(path)
+				fingerprint.update(
+					f'{path[len(top):]}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode()
+				)
+		return fingerprint.hexdigest()
+
+	def read(self, path):
+		with open(self.root + path, 'rb') as file:
+			data = file.read()
+		profiler.count('bytes read', len(data))
+		return data
+
+	def digest(self, path):
+		# A hash of the file's content.
+		return hashlib.sha1(self.read(path)).hexdigest()
+
+	def size(self, path):
+		return os.path.getsize(self.root + path)
+
+
+
+class ArchiveSource:
+	'''
+	A data source backed by a zip archive on disk.
+	The archive is memory-mapped and read in place;
+	no member is ever extracted to the filesystem.
+	Paths given to it are relative to the repository root,
+	which is the single top folder (root) of the archive.
+	---
+	Once closed (or pickled, eg. into a worker process),
+	the archive is mapped again on the next read; so lazy
+	entries can still read their templates from it later.
+	Its name (for caches; see source_slot) is its root, which
+	stays the same as new downloads of the branch come in.
+	'''
+	def __init__(self, filepath, root):
+		self.filepath = filepath
+		self.root = root
+		self.name = root
+		with open(filepath, 'rb') as file:
+			self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+			# Only the central directory is parsed here.
+			with ZipFile(file) as zip:
+				members = zip.infolist()
+
+		# Index the members by directory up front.
+		# Directory entries themselves end with a slash.
+		self.members = {}
+		self.directories = {}
+		for member in members:
+			name = member.filename
+			if not name.startswith(root) or name.endswith('/'):
+				continue
+			path = name[len(root):]
+			self.members[path] = member
+			directory, _, filename = path.rpartition('/')
+			directory = directory + '/' if directory else ''
+			self.directories.setdefault(directory, []).append(filename)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *error):
+		self.close()
+
+	def close(self):
+		if self.mmap is not None:
+			self.mmap.close()
+			self.mmap = None
+
+	def __getstate__(self):
+		return {**self.__dict__, 'mmap': None}
+
+	def mapping(self):
+		if self.mmap is None:
+			with open(self.filepath, 'rb') as file:
+				self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		return self.mmap
+
+	def fingerprint(self, version):
+		# The central directory already lists each CRC-32.
+		fingerprint = hashlib.sha256()
+		top = f'source/{version}/'
+		for path in sorted(self.members):
+			if path.startswith(top):
+				member = self.members[path]
+				fingerprint.update(
+					f'{path}\0{member.file_size}\0{member.CRC}\n'.encode()
+				)
+		return fingerprint.hexdigest()
+
+	def filenames(self, directory):
+		if directory not in self.directories:
+			raise FileNotFoundError(self.root + directory)
+		return self.directories[directory]
+
+	def digest(self, path):
+		# The central directory's CRC-32 (and size) will do.
+		member = self.members.get(path)
+		if member is None:
+			raise FileNotFoundError(self.root + path)
+		return f'{member.CRC:08x}-{member.file_size}'
+
+	def size(self, path):
+		member = self.members.get(path)
+		if member is None:
+			raise FileNotFoundError(self.root + path)
+		return member.file_size
+
+	def read(self, path):
+		member = self.members.get(path)
+		if member is None:
+			raise FileNotFoundError(self.root + path)
+
+		# Skip past the member's local file header.
+		# Its name and extra field lengths live at offset 26.
+		mapping = self.mapping()
+		offset = member.header_offset
+		name_size, extra_size = struct.unpack_from('<HH', mapping, offset + 26)
+		start = offset + 30 + name_size + extra_size
+		data = mapping[start:start + member.compress_size]
+
+		# Only stored and deflated members are expected.
+		if member.compress_type == ZIP_DEFLATED:
+			data = zlib.decompress(data, -zlib.MAX_WBITS)
+		elif member.compress_type != ZIP_STORED:
+			raise NotImplementedError(f'{path}: compression {member.compress_type}')
+		if zlib.crc32(data) != member.CRC:
+			raise BadZipFile(f'{path}: bad CRC-32')
+		profiler.count('bytes read', len(data))
+		return data
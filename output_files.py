@@ -0,0 +1,176 @@
+from zipfile import ZipFile, ZIP_STORED
+from io import TextIOWrapper
+import hashlib
+import struct
+import json
+import os
+import re
+
+
+
+class SummaryFiles:
+	'''
+	This opens a sink per class summary, as open_sink(class_name),
+	writing into one output directory; but a summary only
+	replaces its file when the rendered content changed.
+	Unchanged files are left alone, mtime and all, so that
+	nothing downstream (a site build, rsync) sees them as new.
+	---
+	Each summary is written to a temporary file as it renders,
+	hashing it along the way; on close, it is compared with
+	the hash of the existing file, then either renamed over it
+	(atomically) or thrown away. Counts are kept in stats().
+	'''
+	def __init__(self, output_dir):
+		self.output_dir = output_dir
+		self.written = []
+		self.skipped = []
+		self.removed = []
+		os.makedirs(output_dir, exist_ok=True)
+
+	def __call__(self, class_name):
+		return SummaryFile(self, class_name)
+
+	def filepath(self, class_name):
+		return f'{self.output_dir}{class_name}.md'
+
+	def remove(self, class_name):
+		try:
+			os.remove(self.filepath(class_name))
+		except FileNotFoundError:
+			return
+		self.removed.append(class_name)
+
+	def prune(self, class_names):
+		'''
+		This deletes the summaries of any class not named,
+		eg. classes that no longer exist upstream, along with
+		any partial file left behind by an interrupted build.
+		'''
+		keep = {f'{class_name}.md' for class_name in class_names}
+		for filename in sorted(os.listdir(self.output_dir)):
+			if filename.endswith('.md') and filename not in keep:
+				self.remove(filename[:-len('.md')])
+			elif re.fullmatch(r'.+\.md\.\d+\.partial', filename):
+				os.remove(self.output_dir + filename)
+
+	def stats(self):
+		return {
+			'written': len(self.written),
+			'skipped': len(self.skipped),
+			'removed': len(self.removed),
+		}
+
+
+
+class SummaryFile:
+	'''
+	One summary being written (see SummaryFiles).
+	'''
+	def __init__(self, files, class_name):
+		self.files = files
+		self.class_name = class_name
+		self.filepath = files.filepath(class_name)
+		self.partial = f'{self.filepath}.{os.getpid()}.partial'
+		self.file = open(self.partial, 'w')
+		self.hash = hashlib.sha256()
+
+	def write(self, text):
+		self.hash.update(text.encode())
+		self.file.write(text)
+
+	def abort(self):
+		# Rendering failed; drop the partial file, keep the old one.
+		self.file.close()
+		os.remove(self.partial)
+
+	def close(self):
+		self.file.close()
+		if content_hash(self.filepath) == self.hash.digest():
+			os.remove(self.partial)
+			self.files.skipped.append(self.class_name)
+		else:
+			os.replace(self.partial, self.filepath)
+			self.files.written.append(self.class_name)
+
+
+
+def content_hash(filepath):
+	# Read as text, like it was written; None if missing.
+	content = hashlib.sha256()
+	try:
+		with open(filepath) as file:
+			for chunk in iter(lambda: file.read(1 << 16), ''):
+				content.update(chunk.encode())
+	except FileNotFoundError:
+		return None
+	return content.digest()
+
+
+
+class SummaryArchive:
+	'''
+	This opens a sink per class summary, as open_sink(class_name),
+	streaming every summary into one zip archive as it renders.
+	Once closed, a JSON index is written next to the archive
+	(as <archive>.json): each class -> its member's offset and
+	size, so one summary can be read without unpacking any.
+	---
+	Members are stored uncompressed, which is what makes them
+	readable in place; zip them again to ship them smaller.
+	The archive only replaces any old one once complete.
+	'''
+	def __init__(self, filepath):
+		self.filepath = filepath
+		self.partial = f'{filepath}.{os.getpid()}.partial'
+		self.zip = ZipFile(self.partial, 'w', ZIP_STORED)
+		self.classes = []
+		self.member = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *error):
+		if error[0] is None:
+			self.close()
+			return
+		# The zip cannot close while a member is still open; so
+		# 	close that first. Either may fail, but only the error
+		# 	that got us here is worth raising.
+		try:
+			if self.member is not None and not self.member.closed:
+				self.member.close()
+			self.zip.close()
+		except Exception:
+			pass
+		os.remove(self.partial)
+
+	def __call__(self, class_name):
+		self.classes.append(class_name)
+		member = self.zip.open(f'{class_name}.md', 'w')
+		self.member = TextIOWrapper(member, encoding = 'utf-8')
+		return self.member
+
+	def close(self):
+		self.zip.close()
+
+		# Find where each member's data starts: just past its
+		# 	local file header, whose name and extra field
+		# 	lengths live at offset 26.
+		index = {}
+		with open(self.partial, 'rb') as file, ZipFile(file) as zip:
+			for class_name in self.classes:
+				member = zip.getinfo(f'{class_name}.md')
+				file.seek(member.header_offset + 26)
+				name_size, extra_size = struct.unpack('<HH', file.read(4))
+				index[class_name] = {
+					'member': member.filename,
+					'offset': member.header_offset + 30 + name_size + extra_size,
+					'size': member.file_size,
+				}
+
+		os.replace(self.partial, self.filepath)
+		partial = f'{self.filepath}.json.{os.getpid()}.partial'
+		with open(partial, 'w') as file:
+			json.dump(index, file, indent = '\t')
+		os.replace(partial, self.filepath + '.json')
@@ -0,0 +1,151 @@
+from contextlib import contextmanager
+from time import perf_counter
+import threading
+import json
+import os
+
+# The profiler is off unless start() is called; while it is
+# 	off, every hook below returns right away.
+enabled = False
+origin = 0.0
+events = []
+counters = {}
+
+
+
+def start():
+	'''
+	This turns the profiler on, clearing anything recorded.
+	'''
+	global enabled, origin
+	enabled = True
+	origin = perf_counter()
+	events.clear()
+	counters.clear()
+
+
+
+def stop():
+	global enabled
+	enabled = False
+
+
+
+@contextmanager
+def stage(name, category = 'stage', **details):
+	'''
+	This times the code run inside it, as one named event.
+	Categories used: stage, class, feature.
+	'''
+	if not enabled:
+		yield
+		return
+	started = perf_counter()
+	try:
+		yield
+	finally:
+		record(name, category, started, perf_counter(), details)
+
+
+
+def record(name, category, started, ended, details = {}):
+	if enabled:
+		events.append((name, category, started, ended, threading.get_ident(), details))
+
+
+
+# Counters may be bumped from reader threads.
+counters_lock = threading.Lock()
+def count(name, amount = 1):
+	if enabled:
+		with counters_lock:
+			counters[name] = counters.get(name, 0) + amount
+
+
+
+def collect():
+	'''
+	This hands over (and clears) everything recorded so far,
+	as (events, counters); eg. by a worker process, for its
+	parent to merge. Nothing is recorded while off.
+	'''
+	with counters_lock:
+		recorded = events[:], dict(counters)
+		events.clear()
+		counters.clear()
+	return recorded
+
+
+
+def merge(more_events, more_counters):
+	'''
+	This adds what another process recorded (see collect).
+	Both use perf_counter, one system-wide clock, so its
+	events line up with the ones recorded here.
+	'''
+	if enabled:
+		events.extend(more_events)
+		with counters_lock:
+			for name, amount in more_counters.items():
+				counters[name] = counters.get(name, 0) + amount
+
+
+
+def report(slowest = 20):
+	'''
+	This summarizes everything recorded, ready to save as JSON:
+	seconds per stage, per class and per feature (summed over
+	its classes), the slowest single feature renders, and all
+	of the counters.
+	'''
+	totals = {'stage': {}, 'class': {}, 'feature': {}}
+	renders = []
+	for name, category, started, ended, _, details in events:
+		seconds = ended - started
+		group = totals.setdefault(category, {})
+		group[name] = group.get(name, 0.0) + seconds
+		if category == 'feature':
+			renders.append({**details, 'feature': name, 'seconds': seconds})
+	renders.sort(key = lambda render: render['seconds'], reverse = True)
+	return {
+		'stages': totals['stage'],
+		'classes': totals['class'],
+		'features': totals['feature'],
+		'slowest renders': renders[:slowest],
+		'counters': dict(counters),
+	}
+
+
+
+def write_report(filepath):
+	with open(filepath, 'w') as file:
+		json.dump(report(), file, indent='\t')
+
+
+
+def write_chrome_trace(filepath):
+	'''
+	This saves every event in the Chrome trace-event format,
+	which chrome://tracing and Perfetto can both open.
+	'''
+	trace = []
+	for name, category, started, ended, thread, details in events:
+		trace.append({
+			'name': name,
+			'cat': category,
+			'ph': 'X',
+			'ts': (started - origin) * 1e6,
+			'dur': (ended - started) * 1e6,
+			'pid': os.getpid(),
+			'tid': thread,
+			'args': details,
+		})
+	trace.append({
+		'name': 'counters',
+		'ph': 'C',
+		'ts': (perf_counter() - origin) * 1e6,
+		'pid': os.getpid(),
+		'args': dict(counters),
+	})
+	with open(filepath, 'w') as file:
+		json.dump({'traceEvents': trace}, file)
@@ -0,0 +1,227 @@
+from arrange_data import arrange_class_features
+from arrange_data import compose_class_progressions
+from write_feature_descriptions import generate_descriptions
+from write_feature_descriptions import describe_feature_class
+from write_feature_descriptions import RenderCache, compile_template
+from write_class_summaries import generate_summaries, table_cache
+from data_model import thaw, DataProblems
+from lint import check
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter
+import json
+
+
+
+class RenderService:
+	'''
+	This keeps the corpus in memory, and renders from it on
+	request: class summaries, feature descriptions (for one
+	class) and progression tables. Rendered responses are kept
+	in a bounded LRU cache of (kind, name, class) -> response,
+	evicting the least recently used beyond capacity.
+	---
+	The corpus comes from load(), as a (classes, features) pair,
+	and is linted before it is used (see lint.check);
+	reload() calls it again and drops every cached render.
+	Lookups are counted, and request latencies are recorded
+	per kind of request (see stats).
+	'''
+	def __init__(self, load, capacity = 256):
+		self.load = load
+		self.capacity = capacity
+		self.lock = Lock()
+		self.hits = 0
+		self.misses = 0
+		self.reloads = 0
+		self.latencies = {}
+		self.reload()
+
+	def reload(self):
+		# Bad data raises DataProblems; the old corpus stays.
+		all_classes, all_features = self.load()
+		check(all_classes, all_features)
+		class_features = arrange_class_features(all_features)
+		with self.lock:
+			self.all_classes = all_classes
+			self.all_features = all_features
+			self.class_features = class_features
+			# Classes without any features still get a table.
+			self.class_progressions = compose_class_progressions({
+				**{class_name: {} for class_name in all_classes},
+				**class_features,
+			})
+			self.render_cache = RenderCache()
+			self.descriptions = {}
+			self.renders = OrderedDict()
+			compile_template.cache_clear()
+			table_cache.clear()
+			self.reloads += 1
+
+	def lookup(self, kind, name, class_name = None):
+		'''
+		This returns a cached render, rendering it first if need be.
+		Unknown classes and features raise a KeyError.
+		'''
+		key = (kind, name, class_name)
+		with self.lock:
+			if key in self.renders:
+				self.hits += 1
+				self.renders.move_to_end(key)
+				return self.renders[key]
+			self.misses += 1
+
+			if kind == 'classes':
+				rendered = self.summary(name)
+			elif kind == 'features':
+				rendered = self.description(name, class_name)
+			elif kind == 'progression':
+				rendered = json.dumps(thaw(self.class_progressions[name]), indent = '\t')
+			else:
+				raise KeyError(kind)
+
+			self.renders[key] = rendered
+			if len(self.renders) > self.capacity:
+				self.renders.popitem(last = False)
+			return rendered
+
+	def summary(self, class_name):
+		features = self.class_features.get(class_name, {})
+		class_data = self.all_classes[class_name]
+		generate_descriptions(
+			self.all_features,
+			self.descriptions,
+			cache = self.render_cache,
+			only = features,
+			classes = [class_name],
+		)
+		summaries = generate_summaries(
+			{class_name: features},
+			{class_name: self.class_progressions[class_name]},
+			{class_name: class_data},
+			self.descriptions,
+		)
+		return summaries[class_name]
+
+	def description(self, feature_name, class_name):
+		feature = self.all_features[feature_name]
+		if class_name not in feature.get('classes', {}):
+			raise KeyError(class_name)
+		return describe_feature_class(
+			self.all_features, feature_name, class_name, self.render_cache,
+		)
+
+	def record(self, kind, seconds):
+		with self.lock:
+			latency = self.latencies.setdefault(kind, {
+				'requests': 0, 'total ms': 0.0, 'max ms': 0.0,
+			})
+			latency['requests'] += 1
+			latency['total ms'] += seconds * 1000
+			latency['max ms'] = max(latency['max ms'], seconds * 1000)
+
+	def stats(self):
+		with self.lock:
+			lookups = self.hits + self.misses
+			return {
+				'hits': self.hits,
+				'misses': self.misses,
+				'hit rate': self.hits / lookups if lookups else 0.0,
+				'entries': len(self.renders),
+				'capacity': self.capacity,
+				'reloads': self.reloads,
+				'render cache': self.render_cache.stats(),
+				'latency': {
+					kind: {
+						**latency,
+						'mean ms': latency['total ms'] / latency['requests'],
+					}
+					for kind, latency in self.latencies.items()
+				},
+			}
+
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+	'''
+	This answers requests to a RenderService (as self.server.service):
+	---
+	GET /classes/<name>.md: a class summary, as markdown,
+	GET /features/<slug>?class=<name>: a feature's description,
+	GET /progression/<name>.json: a class's progression table,
+	GET /stats: cache and latency counters, as JSON,
+	POST /reload: reload the corpus, dropping every cached render
+		(or, if the new data has problems, keeping the old corpus).
+	'''
+	def do_GET(self):
+		started = perf_counter()
+		url = urlsplit(self.path)
+		kind, _, name = url.path.strip('/').partition('/')
+		name = unquote(name)
+		service = self.server.service
+
+		if kind == 'stats' and not name:
+			self.respond(200, json.dumps(service.stats(), indent = '\t'), 'application/json')
+			return
+
+		content_type = 'text/markdown; charset=utf-8'
+		class_name = None
+		if kind == 'classes' and name.endswith('.md'):
+			name = name[:-len('.md')]
+		elif kind == 'features':
+			class_name = parse_qs(url.query).get('class', [None])[0]
+			if class_name is None:
+				self.respond(400, 'missing ?class=<name>\n')
+				return
+		elif kind == 'progression' and name.endswith('.json'):
+			name = name[:-len('.json')]
+			content_type = 'application/json'
+		else:
+			self.respond(404, f'no such resource: {url.path}\n')
+			return
+
+		try:
+			body = service.lookup(kind, name, class_name)
+		except KeyError as error:
+			self.respond(404, f'not found: {error}\n')
+			return
+		self.respond(200, body, content_type)
+		service.record(kind, perf_counter() - started)
+
+	def do_POST(self):
+		if self.path.strip('/') != 'reload':
+			self.respond(404, f'no such resource: {self.path}\n')
+			return
+		started = perf_counter()
+		try:
+			self.server.service.reload()
+		except DataProblems as error:
+			self.respond(422, f'{error}\n')
+			return
+		self.server.service.record('reload', perf_counter() - started)
+		self.respond(200, json.dumps(self.server.service.stats(), indent = '\t'), 'application/json')
+
+	def respond(self, status, body, content_type = 'text/plain; charset=utf-8'):
+		body = body.encode()
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+
+def serve(service, host = '127.0.0.1', port = 8000, report = print):
+	'''
+	This serves a RenderService over HTTP, until interrupted.
+	'''
+	server = ThreadingHTTPServer((host, port), RenderHandler)
+	server.service = service
+	report(f'serving on http://{host}:{server.server_address[1]}/')
+	with server:
+		server.serve_forever()
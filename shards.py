@@ -0,0 +1,239 @@
+from obtain_data import features_directory, classes_directory
+from corpus_index import load_index, needed_features, load_classes
+from arrange_data import arrange_class_features
+from arrange_data import compose_class_progressions
+from write_feature_descriptions import generate_descriptions
+from write_class_summaries import stream_summaries
+from output_files import SummaryFiles
+from incremental import input_hashes
+from lint import check
+from data_model import DataProblems
+import hashlib
+import json
+import os
+
+# Bump this whenever the shape of a shard manifest changes.
+SHARD_FORMAT = 2
+
+
+
+def parse_shard(text):
+	'''
+	This turns 'k/N' into (k, N), where 1 <= k <= N.
+	'''
+	shard, _, count = text.partition('/')
+	try:
+		shard, count = int(shard), int(count)
+	except ValueError:
+		raise ValueError(f'expected k/N, not {text!r}')
+	if not 1 <= shard <= count:
+		raise ValueError(f'shard {shard} is not within 1 to {count}')
+	return shard, count
+
+
+
+def class_costs(source, version, index):
+	'''
+	This estimates the work of building each class summary,
+	as the size (in bytes) of everything it reads: its own
+	files, and those of every feature it needs (children too).
+	Sizes come straight from the source; nothing is read.
+	'''
+	def entry_size(directory, slug):
+		return source.size(directory + slug + '.json') \
+			+ source.size(directory + slug + '.md')
+
+	costs = {}
+	for class_name in sorted(index['classes']):
+		cost = entry_size(classes_directory(version), class_name)
+		for feature_name in sorted(needed_features(index, [class_name])):
+			cost += entry_size(features_directory(version), feature_name)
+		costs[class_name] = cost
+	return costs
+
+
+
+def assign_shards(costs, count):
+	'''
+	This spreads the classes across count shards, so each gets
+	about the same total cost: the costliest class goes first,
+	always to the shard with the least work so far (ties go to
+	the lowest shard). The same costs give the same shards.
+	Shards are numbered from 1; each class -> its shard returns.
+	'''
+	loads = [0] * count
+	assignment = {}
+	for class_name in sorted(costs, key = lambda name: (-costs[name], name)):
+		shard = min(range(count), key = lambda shard: (loads[shard], shard))
+		loads[shard] += costs[class_name]
+		assignment[class_name] = shard + 1
+	return dict(sorted(assignment.items()))
+
+
+
+def shard_folder(shard_dir, shard, count):
+	return f'{shard_dir}{shard}-of-{count}/'
+
+
+
+def build_shard(
+	source,
+	version,
+	shard,
+	count,
+	shard_dir = './shards/',
+	workers = 1,
+	jobs = 1,
+):
+	'''
+	This builds one shard (shard of count) of the summaries:
+	only its own classes, and only the features they need.
+	The summaries, plus a manifest.json, go into the folder
+	shard_dir/<shard>-of-<count>/; see merge_shards.
+	---
+	The manifest records the whole assignment of classes to
+	shards, the inputs' identity, and a sha256 hash of every
+	summary written, so a merge can check all shards agree.
+	The manifest returns.
+	'''
+	index = load_index(source, version)
+	costs = class_costs(source, version, index)
+	assignment = assign_shards(costs, count)
+	class_names = [
+		class_name
+		for class_name, owner in assignment.items()
+		if owner == shard
+	]
+
+	all_classes, all_features = load_classes(
+		source, version, class_names, workers, index,
+	)
+	class_features = arrange_class_features(all_features)
+	needed = set()
+	for class_name in class_names:
+		needed.update(class_features.get(class_name, {}))
+	check(all_classes, all_features, only = needed, classes = class_names)
+	descriptions = {}
+	generate_descriptions(
+		all_features, descriptions,
+		jobs = jobs, only = needed, classes = class_names,
+	)
+	class_progressions = compose_class_progressions({
+		class_name: class_features.get(class_name, {})
+		for class_name in class_names
+	})
+
+	folder = shard_folder(shard_dir, shard, count)
+	files = SummaryFiles(folder)
+	stream_summaries(
+		class_features, class_progressions, all_classes, descriptions, files,
+	)
+	files.prune(class_names)
+
+	manifest = {
+		'format': SHARD_FORMAT,
+		'version': version,
+		'fingerprint': inputs_identity(source, version),
+		'shard': shard,
+		'count': count,
+		'cost': sum(costs[class_name] for class_name in class_names),
+		'assignment': assignment,
+		'summaries': {
+			class_name: file_hash(files.filepath(class_name))
+			for class_name in class_names
+		},
+	}
+	partial = folder + f'manifest.json.{os.getpid()}.partial'
+	with open(partial, 'w') as file:
+		json.dump(manifest, file, indent = '\t')
+	os.replace(partial, folder + 'manifest.json')
+	return manifest
+
+
+
+def merge_shards(shard_dir = './shards/', output_dir = './class_summaries/'):
+	'''
+	This assembles the summaries of every shard into output_dir,
+	after checking the shards: one of each, built from the same
+	data, agreeing on the assignment, with every class built
+	by its own shard, and every summary matching its hash.
+	Every problem found is raised at once, as DataProblems.
+	---
+	Summaries are written only if changed (see SummaryFiles),
+	and summaries of classes no shard owns are deleted.
+	The SummaryFiles used returns, to inspect its counts.
+	'''
+	manifests = []
+	names = os.listdir(shard_dir) if os.path.isdir(shard_dir) else []
+	for name in sorted(names):
+		filepath = os.path.join(shard_dir, name, 'manifest.json')
+		if os.path.isfile(filepath):
+			with open(filepath) as file:
+				manifests.append(json.load(file))
+	if not manifests:
+		raise DataProblems([f'no shards in {shard_dir}'], 'cannot merge shards')
+
+	problems = []
+	first = manifests[0]
+	shards = {}
+	for manifest in manifests:
+		label = f'shard {manifest.get("shard")}/{manifest.get("count")}'
+		for field in ['format', 'version', 'fingerprint', 'count', 'assignment']:
+			if manifest.get(field) != first.get(field):
+				problems.append(f'{label}: {field} differs from the other shards')
+		if manifest.get('shard') in shards:
+			problems.append(f'{label}: built more than once')
+		shards[manifest.get('shard')] = manifest
+	for shard in range(1, first['count'] + 1):
+		if shard not in shards:
+			problems.append(f'shard {shard}/{first["count"]}: missing')
+
+	# Every class must come from its own shard, intact.
+	summaries = {}
+	for class_name, owner in first['assignment'].items():
+		manifest = shards.get(owner)
+		if manifest is None:
+			continue
+		if class_name not in manifest['summaries']:
+			problems.append(f'{class_name}: not built by shard {owner}')
+			continue
+		filepath = shard_folder(shard_dir, owner, first['count']) + f'{class_name}.md'
+		if not os.path.isfile(filepath):
+			problems.append(f'{class_name}: {filepath} is missing')
+		elif file_hash(filepath) != manifest['summaries'][class_name]:
+			problems.append(f'{class_name}: {filepath} does not match its hash')
+		else:
+			summaries[class_name] = filepath
+	for manifest in manifests:
+		for class_name in manifest.get('summaries', {}):
+			if first['assignment'].get(class_name) != manifest.get('shard'):
+				problems.append(f'{class_name}: built by shard {manifest.get("shard")}, which does not own it')
+	if problems:
+		raise DataProblems(problems, 'cannot merge shards')
+
+	files = SummaryFiles(output_dir)
+	for class_name, filepath in summaries.items():
+		sink = files(class_name)
+		with open(filepath) as file:
+			for chunk in iter(lambda: file.read(1 << 16), ''):
+				sink.write(chunk)
+		sink.close()
+	files.prune(summaries)
+	return files
+
+
+
+def file_hash(filepath):
+	with open(filepath, 'rb') as file:
+		return hashlib.sha256(file.read()).hexdigest()
+
+
+
+def inputs_identity(source, version):
+	'''
+	This identifies the data a shard was built from by its
+	content alone (see incremental.input_hashes), so shards
+	built from separate checkouts of the same tree agree.
+	'''
+	hashes = json.dumps(input_hashes(source, version), sort_keys = True)
+	return hashlib.sha256(hashes.encode()).hexdigest()
@@ -0,0 +1,91 @@
+import profiler
+import hashlib
+import pickle
+import json
+import os
+
+# Bump this whenever the shape of the loaded corpus changes.
+SNAPSHOT_FORMAT = 2
+
+
+
+def snapshot_key(fingerprint, version):
+	'''
+	A snapshot is keyed by a hash of its source tree
+	(the fingerprint), the data version, and the format.
+	'''
+	key = hashlib.sha256()
+	key.update(f'{SNAPSHOT_FORMAT}\n{version}\n'.encode())
+	key.update(fingerprint.encode())
+	return key.hexdigest()
+
+
+
+def load_snapshot(key, snapshot_dir = './downloads/snapshots/'):
+	'''
+	This returns the (classes, features) pair saved under key,
+	or None if there is no such snapshot (or it is unreadable).
+	The whole file is taken in with a single read.
+	'''
+	try:
+		with open(snapshot_dir + key + '.pickle', 'rb') as file:
+			data = file.read()
+		profiler.count('bytes read', len(data))
+		return pickle.loads(data)
+	except (OSError, pickle.UnpicklingError, EOFError):
+		return None
+
+
+
+def save_snapshot(key, corpus, snapshot_dir = './downloads/snapshots/', slot = None):
+	'''
+	This saves a freshly loaded (classes, features) pair.
+	It must be saved before any later stage modifies it.
+	Given a slot (eg. a source and version; see source_slot),
+	the snapshot it replaces there is deleted.
+	'''
+	os.makedirs(snapshot_dir, exist_ok=True)
+	data = pickle.dumps(corpus, protocol=pickle.HIGHEST_PROTOCOL)
+
+	# Swap the file in whole so it is never half-written.
+	partial = snapshot_dir + f'partial-{os.getpid()}.pickle'
+	with open(partial, 'wb') as file:
+		file.write(data)
+	os.replace(partial, snapshot_dir + key + '.pickle')
+	if slot is not None:
+		replace_latest(snapshot_dir, slot, key + '.pickle')
+
+
+
+def source_slot(source, version):
+	# One source (wherever its content comes from), one version.
+	return f'{source.name}\0{version}'
+
+
+
+def replace_latest(directory, slot, filename):
+	'''
+	This records filename as the latest file of a slot, in
+	the directory's latest.json, and deletes the file that
+	held the slot before (unless another slot still uses it).
+	So a cache keeps one file per slot, not one per edit.
+	'''
+	filepath = directory + 'latest.json'
+	try:
+		with open(filepath) as file:
+			latest = json.load(file)
+	except (FileNotFoundError, ValueError):
+		latest = {}
+	previous = latest.get(slot)
+	latest[slot] = filename
+
+	# Swap the file in whole so it is never half-written.
+	partial = filepath + f'.{os.getpid()}.partial'
+	with open(partial, 'w') as file:
+		json.dump(latest, file, indent = '\t')
+	os.replace(partial, filepath)
+	if previous is not None and previous not in latest.values():
+		try:
+			os.remove(directory + previous)
+		except FileNotFoundError:
+			pass
@@ -0,0 +1,169 @@
+from collections.abc import Mapping
+import sqlite3
+import json
+import os
+
+# Bump this whenever the schema changes.
+EXPORT_FORMAT = 1
+
+schema = '''
+create table export (format integer not null);
+create table classes (
+	name text primary key,
+	hit_dice text
+);
+create table features (
+	slug text primary key,
+	name text
+);
+create table class_features (
+	class text not null references classes (name),
+	feature text not null references features (slug),
+	level integer,
+	primary key (class, feature)
+);
+create table level_features (
+	class text not null,
+	level integer not null,
+	position integer not null,
+	feature text not null,
+	primary key (class, level, position)
+);
+create table progression_cells (
+	class text not null,
+	level integer not null,
+	position integer not null,
+	column text not null,
+	subcolumn text,
+	value,
+	primary key (class, level, position)
+);
+create table descriptions (
+	feature text not null references features (slug),
+	class text not null,
+	description text not null,
+	primary key (feature, class)
+);
+create index progression_cells_by_column on progression_cells (class, column, level);
+create index descriptions_by_class on descriptions (class);
+'''
+
+
+
+def export_sqlite(
+	filepath,
+	all_classes,
+	all_features,
+	class_features,
+	class_progressions,
+	descriptions,
+):
+	'''
+	This writes the compiled data into a new SQLite database:
+	---
+	classes: each class, with its hit dice,
+	features: each feature, by slug,
+	class_features: each class's features, from which level,
+	level_features: the Features column of each class table,
+	progression_cells: every other cell of each class table,
+		one row per sub-column for grouped columns,
+	descriptions: each feature's description, per class.
+	---
+	Tables are keyed by (class, level, ...) and by feature
+	slug, so a question like "what does a level 7 rogue get"
+	is a single indexed query. Everything is inserted in one
+	transaction, and the database replaces any old one whole.
+	'''
+	partial = filepath + f'.{os.getpid()}.partial'
+	if os.path.exists(partial):
+		os.remove(partial)
+	connection = sqlite3.connect(partial)
+	try:
+		# Nothing is read until the export is complete.
+		connection.execute('pragma journal_mode = off')
+		connection.execute('pragma synchronous = off')
+		connection.executescript(schema)
+		with connection:
+			connection.execute('insert into export values (?)', (EXPORT_FORMAT,))
+			connection.executemany(
+				'insert into classes values (?, ?)',
+				(
+					(class_name, class_data.get('hit-dice'))
+					for class_name, class_data in all_classes.items()
+				),
+			)
+			connection.executemany(
+				'insert into features values (?, ?)',
+				(
+					(feature_name, feature.get('name'))
+					for feature_name, feature in all_features.items()
+				),
+			)
+			connection.executemany(
+				'insert into class_features values (?, ?, ?)',
+				(
+					(class_name, feature_name, first_level(feature, class_name))
+					for class_name, features in class_features.items()
+					for feature_name, feature in features.items()
+				),
+			)
+			connection.executemany(
+				'insert into level_features values (?, ?, ?, ?)',
+				(
+					(class_name, row['Level'], position, feature)
+					for class_name, progression in class_progressions.items()
+					for row in progression
+					for position, feature in enumerate(row.get('Features', ()))
+				),
+			)
+			connection.executemany(
+				'insert into progression_cells values (?, ?, ?, ?, ?, ?)',
+				(
+					(class_name, row['Level'], *cell)
+					for class_name, progression in class_progressions.items()
+					for row in progression
+					for cell in progression_cells(row)
+				),
+			)
+			connection.executemany(
+				'insert into descriptions values (?, ?, ?)',
+				(
+					(feature_name, class_name, description)
+					for feature_name, feature_descriptions in descriptions.items()
+					for class_name, description in feature_descriptions.items()
+				),
+			)
+	finally:
+		connection.close()
+	os.replace(partial, filepath)
+
+
+
+def first_level(feature, class_name):
+	progression = feature['classes'][class_name].get('progression')
+	if not progression:
+		return None
+	return min(row['Level'] for row in progression)
+
+
+
+def progression_cells(row):
+	'''
+	This yields each cell of a class table row (but its
+	Level and Features) as (position, column, subcolumn,
+	value); a grouped column yields one per sub-column.
+	Values SQLite cannot hold (eg. lists) are stored as JSON.
+	'''
+	position = 0
+	for column, entry in row.items():
+		if column in ['Level', 'Features']:
+			continue
+		if isinstance(entry, Mapping):
+			cells = entry.items()
+		else:
+			cells = [(None, entry)]
+		for subcolumn, value in cells:
+			if isinstance(value, (list, tuple)):
+				value = json.dumps(value)
+			yield position, column, subcolumn, value
+			position += 1
@@ -0,0 +1,192 @@
+from obtain_data import features_directory, classes_directory
+from obtain_data import load_source, load_entry
+from data_model import load_feature, load_class
+from arrange_data import arrange_class_features
+from write_feature_descriptions import generate_descriptions
+from write_class_summaries import table_cache
+from incremental import dependency_edges, rebuild_classes
+from incremental import find_stale_features, find_stale_classes
+from lint import check
+from time import perf_counter, sleep
+import os
+
+
+
+def watch(
+	source,
+	version,
+	open_sink,
+	remove_sink,
+	interval = 0.05,
+	jobs = 1,
+	report = print,
+):
+	'''
+	This builds every class summary, then keeps watching the
+	source directory (which must be a DirectorySource) for
+	changes, until interrupted. The corpus and descriptions
+	stay in memory; on each change, only the touched files are
+	reloaded, and only the affected summaries are rewritten.
+	Summaries are written to open_sink(class_name), and those
+	of deleted classes are dropped with remove_sink(class_name).
+	---
+	A change that fails to load or render (say, a half-saved
+	file) is reported, then retried along with the next one.
+	'''
+	directories = {
+		'classes': classes_directory(version),
+		'features': features_directory(version),
+	}
+
+	# Build everything once.
+	started = perf_counter()
+	seen = scan(source, directories)
+	corpus = {}
+	corpus['classes'], corpus['features'] = load_source(
+		source, version, snapshot = False,
+	)
+	check(corpus['classes'], corpus['features'])
+	corpus['descriptions'] = {}
+	generate_descriptions(corpus['features'], corpus['descriptions'], jobs = jobs)
+	class_features = arrange_class_features(corpus['features'])
+	edges = dependency_edges(corpus['features'], class_features)
+	rebuild_classes(
+		corpus['classes'], class_features, corpus['descriptions'],
+		corpus['classes'], open_sink,
+	)
+	report(f'built {len(corpus["classes"])} summaries in {milliseconds(started)} ms')
+
+	# Changes not yet rebuilt successfully.
+	pending = {kind: set() for kind in directories}
+	while True:
+		sleep(interval)
+		current = scan(source, directories)
+		if current == seen:
+			continue
+		started = perf_counter()
+
+		# Note every entry with an added, changed or removed file.
+		for kind, filename in seen.keys() | current.keys():
+			if seen.get((kind, filename)) != current.get((kind, filename)):
+				slug, _, _ = filename.rpartition('.')
+				pending[kind].add(slug)
+		seen = current
+
+		# Tables of the previous data are of no more use.
+		table_cache.clear()
+		try:
+			edges, rebuilt, removed = rebuild(
+				source, directories, current, corpus, edges,
+				pending, open_sink, remove_sink, jobs,
+			)
+		except (OSError, ValueError, KeyError) as error:
+			report(f'rebuild failed ({type(error).__name__}: {error}); waiting for changes')
+			continue
+		pending = {kind: set() for kind in directories}
+		report(
+			f'rebuilt {len(rebuilt)} summaries'
+			f' ({", ".join(rebuilt) or "none"}),'
+			f' removed {len(removed)},'
+			f' in {milliseconds(started)} ms'
+		)
+
+
+
+def rebuild(
+	source,
+	directories,
+	current,
+	corpus,
+	edges,
+	touched,
+	open_sink,
+	remove_sink,
+	jobs,
+):
+	'''
+	This reloads the touched entries into the corpus, then
+	re-describes and re-summarizes whatever depends on them.
+	Entries are all parsed before the corpus is modified.
+	The new edges, rebuilt classes and removed classes return.
+	'''
+	# An entry exists as long as both of its files do.
+	loaders = {'classes': load_class, 'features': load_feature}
+	entries = {kind: {} for kind in directories}
+	for kind, slugs in touched.items():
+		for slug in slugs:
+			if (kind, slug + '.json') in current and (kind, slug + '.md') in current:
+				entries[kind][slug] = load_entry(
+					source, directories[kind], slug, loaders[kind],
+				)
+			else:
+				entries[kind][slug] = None
+
+	# Swap the entries in, keeping the slugs sorted like a load.
+	# Descriptions of removed features go with them.
+	for slug, entry in entries['features'].items():
+		if entry is None:
+			corpus['descriptions'].pop(slug, None)
+	for kind, updates in entries.items():
+		collection = corpus[kind]
+		added = False
+		for slug, entry in updates.items():
+			if entry is None:
+				collection.pop(slug, None)
+			else:
+				added |= slug not in collection
+				collection[slug] = entry
+		if added:
+			ordered = sorted(collection.items())
+			collection.clear()
+			collection.update(ordered)
+
+	all_classes, all_features = corpus['classes'], corpus['features']
+	changed_features = {slug for slug, entry in entries['features'].items() if entry}
+	removed_features = {slug for slug, entry in entries['features'].items() if not entry}
+	changed_classes = {slug for slug, entry in entries['classes'].items() if entry}
+	removed_classes = sorted(slug for slug, entry in entries['classes'].items() if not entry)
+
+	# Re-describe the stale features, by old and new edges alike.
+	class_features = arrange_class_features(all_features)
+	new_edges = dependency_edges(all_features, class_features)
+	stale_features = find_stale_features(changed_features, removed_features, edges)
+	stale_features |= find_stale_features(changed_features, removed_features, new_edges)
+	stale_features &= all_features.keys()
+	stale_classes = find_stale_classes(
+		all_classes, new_edges, edges, changed_classes, stale_features,
+	)
+	# A problem in the changes fails the rebuild before it renders.
+	check(
+		{class_name: all_classes[class_name] for class_name in stale_classes},
+		all_features,
+		only = stale_features,
+	)
+	descriptions = corpus['descriptions']
+	generate_descriptions(all_features, descriptions, jobs = jobs, only = stale_features)
+
+	# Re-summarize the stale classes; drop the removed ones.
+	rebuild_classes(all_classes, class_features, descriptions, stale_classes, open_sink)
+	for class_name in removed_classes:
+		remove_sink(class_name)
+	return new_edges, sorted(stale_classes), removed_classes
+
+
+
+def scan(source, directories):
+	'''
+	This maps each (kind, filename) in the watched directories
+	to its modification time and size.
+	'''
+	stats = {}
+	for kind, directory in directories.items():
+		with os.scandir(source.root + directory) as listing:
+			for entry in listing:
+				if entry.is_file():
+					stat = entry.stat()
+					stats[(kind, entry.name)] = (stat.st_mtime_ns, stat.st_size)
+	return stats
+
+
+
+def milliseconds(started):
+	return round((perf_counter() - started) * 1000, 1)
@@ -1,64 +1,267 @@
 import re
 import json
+import hashlib
+import os
+from io import StringIO
+from collections.abc import Mapping
+from data_model import thaw
 from string import ascii_lowercase as alphabet
 from helpers import ordinal
+import profiler
+
+
+
+def generate_summaries(
+	class_features,
+	class_progressions,
+	all_classes,
+	descriptions,
+):
+	'''
+	This returns every class summary, as a dictionary of strings.
+	Feature descriptions come from descriptions, as made by
+	generate_descriptions (feature -> class -> description).
+	For large builds, prefer stream_summaries, which never
+	holds more than a small piece of any summary at once.
+	'''
+	results = {}
+	def open_sink(class_name):
+		results[class_name] = StringIO()
+		return results[class_name]
+	def close_sink(class_name, sink):
+		results[class_name] = sink.getvalue()
+	stream_summaries(
+		class_features, class_progressions, all_classes, descriptions,
+		open_sink, close_sink,
+	)
+	return results
 
 
 
-def generate_summaries(class_features, class_progressions, all_classes):
-	results = {}
+def stream_summaries(
+	class_features,
+	class_progressions,
+	all_classes,
+	descriptions,
+	open_sink,
+	close_sink = lambda class_name, sink: sink.close(),
+):
+	'''
+	This writes every class summary to its own sink,
+	one class at a time, piece by piece as it renders.
+	Sinks come from open_sink(class_name), and anything with
+	a write method will do (a file or an io buffer, say).
+	Once written, each is handed to close_sink. If rendering
+	fails, a sink with an abort method (see SummaryFile) is
+	aborted instead, so no half-written summary is left.
+	'''
 	for class_name in all_classes:
-		features = class_features[class_name]
-		class_data = all_classes[class_name]
-		progression = class_progressions[class_name]
-
-		# Progression table.
-		prog_table = generate_summary_table(progression)
-		prog_table = f'###### {class_name.capitalize()} Table\n' + prog_table
-		# Explaination startout markdown.
-		explained_intro = explain_class_data(class_data, class_name)
-		# Markdown feature summary.
-		feature_summary = summarize(features, class_name)
-
-		# Markdown base.
-		markdown = all_classes[class_name]['desc_template']
-
-		expression = r'`\{\( class-features \)\}`'
-		rgx = re.search(expression, markdown)
-		left_end, right_start = rgx.span()
-		left = markdown[:left_end]
-		right = markdown[right_start:]
-		middle = f'As a {class_name}, you gain the following class features.\n'
-		middle += explained_intro
-		middle += prog_table + '\n'
-		middle += feature_summary
-
-		markdown = left + middle + right
-		markdown = re.sub(r'#{6,}', '######', markdown)
-		markdown = re.sub(r'\n{2,}', '\n\n', markdown)
-		results[class_name] = markdown
-	return results
+		with profiler.stage(class_name, 'class'):
+			sink = open_sink(class_name)
+			try:
+				writer = NormalizingWriter(sink)
+				write_summary(
+					writer.write,
+					class_name,
+					class_features[class_name],
+					class_progressions[class_name],
+					all_classes[class_name],
+					descriptions,
+				)
+				writer.flush()
+			except BaseException:
+				if hasattr(sink, 'abort'):
+					sink.abort()
+				raise
+			close_sink(class_name, sink)
+
+
+
+def write_summary(write, class_name, features, progression, class_data, descriptions):
+	# Markdown base.
+	markdown = class_data['desc_template']
+
+	expression = r'`\{\( class-features \)\}`'
+	rgx = re.search(expression, markdown)
+	left_end, right_start = rgx.span()
+	write(markdown[:left_end])
+	write(f'As a {class_name}, you gain the following class features.\n')
+	# Explaination startout markdown.
+	write_class_data(write, class_data, class_name)
+	# Progression table.
+	write(f'###### {class_name.capitalize()} Table\n')
+	write_summary_table(write, progression)
+	write('\n')
+	# Markdown feature summary.
+	write_feature_summary(write, features, class_name, descriptions)
+	write(markdown[right_start:])
+
+
+
+class NormalizingWriter:
+	'''
+	This passes text on to a sink, normalizing it on the way:
+	runs of six or more '#' become exactly six, and runs of
+	blank lines collapse into one. Text may arrive in any
+	pieces; a run at the end of a piece is held back until
+	the next piece shows where it stops. Call flush at the end.
+	'''
+	def __init__(self, sink):
+		self.sink = sink
+		self.tail = ''
+
+	def write(self, text):
+		text = self.tail + text
+		# Hold back any trailing run of '#' or newlines.
+		if text and text[-1] in '#\n':
+			kept = text.rstrip(text[-1])
+		else:
+			kept = text
+		self.tail = text[len(kept):]
+		if kept:
+			self.emit(normalize(kept))
+
+	def flush(self):
+		if self.tail:
+			self.emit(normalize(self.tail))
+		self.tail = ''
+
+	def emit(self, text):
+		if profiler.enabled:
+			profiler.count('bytes written', len(text.encode()))
+		self.sink.write(text)
+
+
+
+def normalize(markdown):
+	markdown = re.sub(r'#{6,}', '######', markdown)
+	markdown = re.sub(r'\n{2,}', '\n\n', markdown)
+	return markdown
 
 
 
 def generate_summary_table(progression):
-	columns = []
+	markdown = StringIO()
+	write_summary_table(markdown.write, progression)
+	return markdown.getvalue()
+
+
+
+def write_summary_table(write, progression):
+	write(table_cache.render(progression))
+
+
+
+class TableCache:
+	'''
+	This holds rendered progression tables (HTML fragments),
+	keyed by a hash of the progression they came from; so a
+	table is only rendered once per distinct progression, eg.
+	across output targets, or for classes sharing a table.
+	---
+	Once given a directory (see persist), tables are saved
+	there too, and so reused across runs for unchanged classes;
+	after a full build, prune deletes those no longer used.
+	'''
+	def __init__(self):
+		self.tables = {}
+		self.used = set()
+		self.directory = None
+		self.hits = 0
+		self.misses = 0
+
+	def persist(self, directory):
+		os.makedirs(directory, exist_ok=True)
+		self.directory = directory
+
+	def clear(self):
+		# Forget the tables held in memory; saved ones stay.
+		self.tables = {}
+		self.used = set()
+
+	def prune(self):
+		'''
+		This deletes every saved table not used since the
+		cache was made (or cleared); only call it once every
+		class has been summarized.
+		'''
+		if self.directory is None:
+			return
+		for filename in os.listdir(self.directory):
+			key, extension = os.path.splitext(filename)
+			if extension == '.html' and key not in self.used:
+				os.remove(self.directory + filename)
+
+	def render(self, progression):
+		progression = sorted(progression, key = lambda row: row['Level'])
+		key = table_key(progression)
+		self.used.add(key)
+		table = self.tables.get(key)
+		if table is None and self.directory is not None:
+			try:
+				with open(self.directory + key + '.html', encoding = 'utf-8', newline = '') as file:
+					table = file.read()
+			except FileNotFoundError:
+				pass
+		if table is not None:
+			self.hits += 1
+			self.tables[key] = table
+			return table
+
+		self.misses += 1
+		table = render_summary_table(progression)
+		self.tables[key] = table
+		if self.directory is not None:
+			filepath = self.directory + key + '.html'
+			partial = filepath + f'.{os.getpid()}.partial'
+			with open(partial, 'w', encoding = 'utf-8', newline = '') as file:
+				file.write(table)
+			os.replace(partial, filepath)
+		return table
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit rate': self.hits / lookups if lookups else 0.0,
+		}
+
+# Tables are shared by every summary written in this process.
+table_cache = TableCache()
+
+# Bump this whenever the table HTML changes.
+TABLE_FORMAT = 1
+
+def table_key(progression):
+	key = hashlib.sha256(f'{TABLE_FORMAT}\n'.encode())
+	key.update(json.dumps(thaw(progression)).encode())
+	return key.hexdigest()
+
+
+
+def table_schema(progression):
+	'''
+	This finds a table's columns, in order of appearance, and
+	the sub-columns of each grouped column, as ordered sets
+	(dictionaries of column -> None), in one pass over the rows.
+	'''
+	columns = {}
 	grouped_columns = {}
-	markdown = ''
-	progression.sort(key = lambda row: row['Level'])
-
 	for row in progression:
-		for column in row:
-			if column not in columns:
-				columns.append(column)
-			if isinstance(row[column], dict):
-				if column not in grouped_columns:
-					grouped_columns[column] = []
-				for subcolumn, entry in row[column].items():
-					if subcolumn not in grouped_columns[column]:
-						grouped_columns[column].append(subcolumn)
-
-	markdown += '<table>\n\t<thead>\n\t\t<tr>'
+		for column, entry in row.items():
+			columns[column] = None
+			if isinstance(entry, Mapping):
+				subcolumns = grouped_columns.setdefault(column, {})
+				for subcolumn in entry:
+					subcolumns[subcolumn] = None
+	return columns, grouped_columns
+
+
+
+def render_summary_table(progression):
+	columns, grouped_columns = table_schema(progression)
+	pieces = ['<table>\n\t<thead>\n\t\t<tr>']
 	for column in columns:
 		if column in grouped_columns:
 			column_span = len(grouped_columns[column])
@@ -66,68 +269,69 @@ def generate_summary_table(progression):
 		else:
 			column_span = 1
 			row_span = 2
-		markdown += '\n\t\t\t<th '
-		markdown += f'colspan="{column_span}" '
-		markdown += f'rowspan="{row_span}">'
-		markdown += column
-		markdown += '</th>'
-	markdown += '\n\t\t</tr>'
+		pieces.append(
+			f'\n\t\t\t<th colspan="{column_span}" rowspan="{row_span}">{column}</th>'
+		)
+	pieces.append('\n\t\t</tr>')
 
 	if len(grouped_columns) > 0:
-		markdown += '\n\t\t<tr>'
+		pieces.append('\n\t\t<tr>')
 		for column in columns:
 			for subcolumn in grouped_columns.get(column, {}):
-				markdown += '\n\t\t\t<th '
-				markdown += 'colspan="1" '
-				markdown += 'rowspan="1">'
-				markdown += subcolumn
-				markdown += '\n\t\t\t</th>'
-		markdown += '\n\t\t</tr>'
-	markdown += '\n\t<tbody>'
+				pieces.append(
+					f'\n\t\t\t<th colspan="1" rowspan="1">{subcolumn}\n\t\t\t</th>'
+				)
+		pieces.append('\n\t\t</tr>')
+	pieces.append('\n\t<tbody>')
 
 	for row in progression:
-		markdown += '\n\t\t<tr>'
-		entries = []
+		pieces.append('\n\t\t<tr>')
 		for column, entry in row.items():
-			if isinstance(entry, dict):
+			if isinstance(entry, Mapping):
 				flag = False
 				for item in entry.values():
 					flag = True
 					if item is None: item = '&mdash;'
-					markdown += f'\n\t\t\t<td>{str(item)}</td>'
+					pieces.append(f'\n\t\t\t<td>{str(item)}</td>')
 				if not flag:
-					markdown += f'\n\t\t\t<td>&mdash;</td>'
+					pieces.append(f'\n\t\t\t<td>&mdash;</td>')
 			else:
-				if isinstance(entry, list):
+				if isinstance(entry, (list, tuple)):
 					entry = ', '.join(entry)
 					if entry == '': entry = '&mdash;'
 				if isinstance(entry, int):
 					entry = ordinal(entry)
 
 				if entry is None: entry = '&mdash;'
-				markdown += f'\n\t\t\t<td>{entry}</td>'
+				pieces.append(f'\n\t\t\t<td>{entry}</td>')
+
+		pieces.append('\n\t\t</tr>')
+	pieces.append('\n\t</tbody>')
+	pieces.append('\n</table>\n')
+	return ''.join(pieces)
 
-		markdown += '\n\t\t</tr>'
-	markdown += '\n\t</tbody>'
-	markdown += '\n</table>\n'
 
-	return markdown
 
+def summarize(features, class_name, descriptions):
+	markdown = StringIO()
+	write_feature_summary(markdown.write, features, class_name, descriptions)
+	return markdown.getvalue()
 
 
-def summarize(features, class_name):
-	# Make an array of features.
-	features = [*features.values()]
+
+def write_feature_summary(write, features, class_name, descriptions):
+	# Make an array of features (with their names).
+	features = [*features.items()]
 	# Sort them nicely.
-	features.sort(key = lambda feature: feature['classes'][class_name]['progression'][0].get('Feature', ''))
-	features.sort(key = lambda feature: feature['classes'][class_name]['progression'][0]['Level'])
+	features.sort(key = lambda item: item[1]['classes'][class_name]['progression'][0].get('Feature', ''))
+	features.sort(key = lambda item: item[1]['classes'][class_name]['progression'][0]['Level'])
 
 	# If the feature is not in the table,
 	# then it doesn't get described independently.
 	# It needs "parental guidance".
-	def filterer(feature):
+	def filterer(item):
 		good_to_go_flag = False
-		for row in feature['classes'][class_name]['progression']:
+		for row in item[1]['classes'][class_name]['progression']:
 			if 'Feature' in row:
 				good_to_go_flag = True
 				break
@@ -135,15 +339,20 @@ def summarize(features, class_name):
 	features = filter(filterer, features)
 
 	# Add every feature to the markdown.
-	markdown = ''
-	for feature in features:
-		markdown += feature['classes'][class_name]['description']
-		markdown += '\n'
-	return markdown
+	for feature_name, feature in features:
+		write(descriptions[feature_name][class_name])
+		write('\n')
 
 
 
 def explain_class_data(class_data, class_name):
+	markdown = StringIO()
+	write_class_data(markdown.write, class_data, class_name)
+	return markdown.getvalue()
+
+
+
+def write_class_data(write, class_data, class_name):
 	# this groups object holds various bullet-lists.
 	# it will be combined later into the markdown.
 	listings = {}
@@ -214,7 +423,7 @@ def explain_class_data(class_data, class_name):
 			for grouping in groupings:
 				items = []
 				for item in grouping['selection']:
-					if isinstance(item, list):
+					if isinstance(item, (list, tuple)):
 						item = conjoin(item)
 					items.append(item)
 
@@ -231,27 +440,31 @@ def explain_class_data(class_data, class_name):
 					items = f'choose {num_choices} from {conjoin(items, "and")}'
 				listing += f'\n\t- {items}'
 		listings[section] = listing
-	markdown = f'''
+	write(f'''
 ## Prerequisites
 Before you can become a {class_name}, you must fulfill some basic prerequisites.
 You are not eligible to become a {class_name} if you do not fit the minimum requirements listed below.
 {listings["Prerequisites"]}
-
+''')
+	write(f'''
 ## Vitality
 You have a pool of hit points and hit dice, which represent your vitality.
 You start with a number of hit points determined by your race.
 As your level increases, so do these pools of vitality, as noted below.
 {listings["Vitality"]}
-
+''')
+	write(f'''
 ## Proficiencies
 You have a set of capabilities that are part and parcel to your vocation.
 The following proficiencies accompany any extended by your race or background.
 {listings["Proficiencies"]}
-
+''')
+	write(f'''
 ## Starting Equipment
 You start with the following items, plus anything provided by your background.
 {listings["Equipment"]}
-
+''')
+	write(f'''
 ## Multiclassing
 Your DM might allow you to use the multiclassing rules outlined in Chapter 6.
 These rules allow you to take levels in other classes when you level up.
@@ -261,5 +474,4 @@ When you first gain a level in a new class via multiclassing, you gain only some
 These proficiencies are listed out here for {class_name}.
 {listings["Multiclassing"]}
 
-'''
-	return markdown
+''')
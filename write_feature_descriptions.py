@@ -1,37 +1,206 @@
 from helpers import read_levels
 from helpers import ordinal
-from functools import reduce
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import profiler
 import re
 infinity = float('inf')
 
 
 
-def generate_descriptions(all_features):
-	# Loop through all the features!
-	for feature in all_features.values():
-		if 'classes' in feature:
-			# Loop through each class in the feature.
-			for class_name in feature.get('classes', {}):
-				feature_class = feature['classes'][class_name]
-				description = describe(feature, class_name)
-				# If the feature has children, loop through them.
-				for child_name in feature_class.get('children', {}):
-					child = all_features[child_name]
-					addon = describe(child, class_name)
-					addon = addon.replace('# ', '## ')
-					if addon != '':
-						description += '\n'
-						description += addon
-				description = description.replace('# ', '## ')
-				# The description is complete for this feature_class!
-				feature_class['description'] = description
+def generate_descriptions(
+	all_features,
+	descriptions,
+	jobs = 1,
+	cache = None,
+	only = None,
+	classes = None,
+):
+	'''
+	This gives every feature a description for every class.
+	Each description goes into descriptions, a dictionary of
+	feature name -> class name -> description; the features
+	themselves are never changed.
+	---
+	Renders go through a RenderCache (a new one by default),
+	so a child shared by many parents is rendered only once
+	per class. The cache is returned, to inspect its counters.
+	---
+	With more than one job, the (feature, class) pairs are
+	rendered in chunks across a pool of processes. Results
+	come back in order, so the outcome is always the same.
+	---
+	If only is given, just the features named in it are
+	described; the rest of descriptions is left as it was.
+	Likewise, if classes is given, only for those classes.
+	'''
+	if cache is None:
+		cache = RenderCache()
+
+	# List every (feature, class) pair needing a description.
+	pairs = []
+	for feature_name, feature in all_features.items():
+		if only is not None and feature_name not in only:
+			continue
+		# Loop through each class in the feature.
+		for class_name in feature.get('classes', {}):
+			if classes is None or class_name in classes:
+				pairs.append((feature_name, class_name))
+
+	if jobs > 1 and len(pairs) > 1:
+		rendered = render_in_parallel(all_features, pairs, jobs, cache)
+	else:
+		rendered = (
+			describe_feature_class(all_features, feature_name, class_name, cache)
+			for feature_name, class_name in pairs
+		)
+
+	# Loop through all the features' classes!
+	for (feature_name, class_name), description in zip(pairs, rendered):
+		# The description is complete for this feature_class!
+		descriptions.setdefault(feature_name, {})[class_name] = description
+
+	return cache
+
+
+
+def describe_feature_class(all_features, feature_name, class_name, cache):
+	'''
+	This renders one feature's full description for a class,
+	including any of its children, with demoted headings.
+	---
+	Demoting the joined description is the same as demoting
+	each part, so children are spliced in already demoted:
+	once for being a child, and once more with their parent.
+	'''
+	feature_class = all_features[feature_name]['classes'][class_name]
+	description = cache.render(all_features, feature_name, class_name, 1)
+	# If the feature has children, loop through them.
+	for child_name in feature_class.get('children', {}):
+		addon = cache.render(all_features, child_name, class_name, 2)
+		if addon != '':
+			description += '\n'
+			description += addon
+	return description
+
+
+
+class RenderCache:
+	'''
+	This holds rendered feature descriptions for reuse,
+	keyed by (feature name, class name, heading depth),
+	where depth is how many times headings were demoted.
+	Hits and misses are counted as the cache is used.
+	---
+	A rendered description only depends on the feature itself.
+	So given keys (feature name -> a hash of its content), and
+	a renders dictionary shared by several caches, renders are
+	shared too: eg. across versions of the same corpus.
+	'''
+	def __init__(self, renders = None, keys = None):
+		self.renders = {} if renders is None else renders
+		self.keys = keys
+		self.hits = 0
+		self.misses = 0
+
+	def render(self, all_features, feature_name, class_name, depth):
+		if self.keys is None:
+			key = (feature_name, class_name, depth)
+		else:
+			key = (self.keys[feature_name], class_name, depth)
+		if key in self.renders:
+			self.hits += 1
+			return self.renders[key]
+		self.misses += 1
+
+		started = perf_counter()
+		description = describe(all_features[feature_name], class_name)
+		profiler.record(feature_name, 'feature', started, perf_counter(), {'class': class_name})
+		for _ in range(depth):
+			description = description.replace('# ', '## ')
+		self.renders[key] = description
+		return description
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit rate': self.hits / lookups if lookups else 0.0,
+		}
+
+
+
+def render_in_parallel(all_features, pairs, jobs, cache):
+	'''
+	This renders (feature, class) pairs in a process pool.
+	Each worker receives all the features once, up front;
+	after that, only chunks of pairs are sent back and forth.
+	The descriptions are returned in the order of the pairs.
+	---
+	Chunks are cut from the pairs sorted by class, so each
+	worker's own render cache sees mostly the same classes.
+	Its hit and miss counts are added to the given cache,
+	and, when profiling, its events and counters are merged
+	into this process's profile.
+	'''
+	order = sorted(range(len(pairs)), key = lambda index: pairs[index][1])
+
+	# A few chunks per job keeps the workers evenly busy.
+	size = max(1, len(pairs) // (jobs * 4))
+	chunks = []
+	for start in range(0, len(order), size):
+		chunks.append([pairs[index] for index in order[start:start + size]])
+
+	descriptions = [None] * len(pairs)
+	with ProcessPoolExecutor(
+		jobs,
+		initializer = start_worker,
+		initargs = (all_features, profiler.enabled),
+	) as pool:
+		results = pool.map(render_chunk, chunks)
+		for start, (chunk, hits, misses, recorded) in zip(range(0, len(order), size), results):
+			for index, description in zip(order[start:start + size], chunk):
+				descriptions[index] = description
+			cache.hits += hits
+			cache.misses += misses
+			profiler.merge(*recorded)
+	return descriptions
+
+
+
+# Every worker process keeps its own copy of the features,
+# 	along with its own render cache (and profile, if on).
+worker_features = None
+worker_cache = None
+def start_worker(all_features, profiling = False):
+	global worker_features, worker_cache
+	worker_features = all_features
+	worker_cache = RenderCache()
+	if profiling:
+		profiler.start()
+
+def render_chunk(pairs):
+	hits, misses = worker_cache.hits, worker_cache.misses
+	descriptions = [
+		describe_feature_class(worker_features, feature_name, class_name, worker_cache)
+		for feature_name, class_name in pairs
+	]
+	hits = worker_cache.hits - hits
+	misses = worker_cache.misses - misses
+	return descriptions, hits, misses, profiler.collect()
 
 
 
 def describe(feature, class_name):
-	markdown = feature['desc_template']
-	# Track each visited text-tag.
-	visited_tags = []
+	# Get the compiled template; it is shared by every class.
+	nodes = compile_template(feature['desc_template'])
+	# Count each visited level text-tag.
+	visited_levels = 0
+	visited_end_levels = False
+	feature_class = None
+	progression = None
 
 	if 'classes' in feature:
 		# Get the class data from this feature.
@@ -43,46 +212,57 @@ def describe(feature, class_name):
 		# Dont try to set progression in this case.
 		if 'progression' in feature_class:
 			# Get the progression table for this class.
+			# It was sorted by level as it was loaded.
 			progression = feature \
 				['classes']         \
 				[class_name]        \
 				['progression']
-			# The progression table may not be sorted. Sort it!
-			progression.sort(key = lambda x: x['Level'])
 
 	# This is where the meat of the function happens.
-	# Try to find a tag.
-	regex_tag = get_tag(markdown)
-	# Transform tags into readable text while they exist.
-	while regex_tag is not None:
-		# Get indices from search result.
-		start, end = regex_tag.span()
-		tag = regex_tag.group()[4:-4]
-		left = markdown[:start]
-		right = markdown[end:]
+	# Each node is either literal text or a tag to replace.
+	# Variable values may hold tags of their own; those are
+	# 	rendered in turn, as if spliced into the template.
+	pieces = []
+	substituted = 0
+	index = 0
+	# The templates to return to, and the variables expanding.
+	outer = []
+	expanding = []
+	while True:
+		if index == len(nodes):
+			if not outer:
+				break
+			nodes, index = outer.pop()
+			expanding.pop()
+			continue
+		node = nodes[index]
+		index += 1
+		if isinstance(node, str):
+			pieces.append(node)
+			continue
+		tag, resume_index, resume_text = node
+		substituted += 1
 		middle = ''
 
 		# Replace tag with designated class name.
 		if tag == 'class':
 			middle = class_name
 
+		# Every other tag needs this feature's class data.
+		elif feature_class is None:
+			raise ValueError(tag)
+
 		# Replace tag with a level signature.
-		elif tag in ['level', 'end-levels', 'all-levels']:
-			# Create and use reducer to get number of matches.
-			reducer = lambda count, tag: count + (tag == 'level')
-			matches = reduce(reducer, visited_tags, 0)
+		elif tag in ['level', 'end-levels', 'all-levels', 'levels']:
+			if progression is None:
+				raise ValueError(tag)
+			matches = visited_levels
 			# The end-levels tag means all tags are visited.
-			if ('end-levels' in visited_tags): matches += infinity
-
-			# If tag is all-levels, add all levels ever.
-			if tag == 'all-levels':
-				# Initialize levels for this action.
-				levels = []
-				# Get all the rows in this feature.
-				for row in progression:
-					# Get the level.
-					level = row['Level']
-					levels.append(level)
+			if visited_end_levels: matches += infinity
+
+			# If tag is all-levels (or levels), add all levels ever.
+			if tag in ['all-levels', 'levels']:
+				levels = [row['Level'] for row in progression]
 				# Add textified level signature ordinals.
 				middle = read_levels(*levels)
 
@@ -91,67 +271,121 @@ def describe(feature, class_name):
 
 				# Add a single level.
 				if tag == 'level':
-					# Get the associated row.
-					row = progression[matches]
-					# Get the level.
-					level = row['Level']
+					# Get the associated row's level.
+					level = progression[matches]['Level']
 					# Add textified level signature ordinals.
 					middle = read_levels(level)
 
-				# Add multiple levels.
+				# Add multiple levels; all the remaining unvisted rows.
 				elif tag == 'end-levels':
-					# Initialize levels for this action.
-					levels = []
-					# Get all the remaining unvisted rows.
-					for row in progression[matches:]:
-						# Get the level.
-						level = row['Level']
-						levels.append(level)
+					levels = [row['Level'] for row in progression[matches:]]
 					# Add textified level signature ordinals.
 					middle = read_levels(*levels)
 
 			# Delete the line if level is out of range.
 			else:
-				# Get expressions.
-				left_expression =  r'(^|\n).*?$'
-				right_expression = r'^.*?(\n|$)'
-				# Get spans.
-				end, _ = re.search(left_expression, left).span()
-				_, start = re.search(right_expression, right).span()
-				# Delete line.
-				left = left[:end]
-				right = right[start:]
-				middle = '\n'
-
-		# Replace tag with a level signature plurality.
-		elif tag == 'levels':
-			# Create reducer.
-			reducer = lambda list, row: [*list, row['Level']]
-			# Use reducer to obtain all levels.
-			levels = reduce(reducer, progression, [])
-			# Add textified level signature ordinals.
-			middle = read_levels(*levels)
+				delete_line(pieces)
+				# The rest of the line, tags and all, is skipped;
+				# 	it may run on past the end of a variable's value.
+				while resume_index is None and outer:
+					nodes, index = outer.pop()
+					expanding.pop()
+					_, resume_index, resume_text = nodes[index - 1]
+				middle = '\n' + resume_text
+				index = len(nodes) if resume_index is None else resume_index
 
 		elif tag in feature_class.get('variables', {}):
 			middle = feature_class['variables'][tag]
+			value_nodes = compile_template(middle)
+			# Render any tags in the value before going on.
+			if any(not isinstance(value_node, str) for value_node in value_nodes):
+				# A value that includes itself would never end.
+				if tag in expanding:
+					raise ValueError(tag)
+				outer.append((nodes, index))
+				expanding.append(tag)
+				nodes, index = value_nodes, 0
+				middle = ''
 
 		# Tag is malformed.
 		else:
 			raise ValueError(tag)
 
 		# Include this processed tag.
-		visited_tags.append(tag)
-		# Update markdown.
-		markdown = left + middle + right
-		# Check next tag.
-		regex_tag = get_tag(markdown)
+		if tag == 'level':
+			visited_levels += 1
+		elif tag == 'end-levels':
+			visited_end_levels = True
+		pieces.append(middle)
 
 	# Return newly cleaned markdown.
-	return markdown
+	profiler.count('tags substituted', substituted)
+	return ''.join(pieces)
+
+
+
+# Every tag looks like `{( name )}`.
+tag_expression = re.compile(r'`\{\( .+? \)\}`')
+# Bounded, so long-running processes (eg. --watch, --serve)
+# 	don't keep every template they have ever seen.
+@lru_cache(maxsize = 1 << 14)
+def compile_template(template):
+	'''
+	This splits a description template, just once, into nodes.
+	Literal text is kept as a string; each tag becomes a tuple:
+	(tag name, node index to resume at, text to resume with).
+	---
+	The resume fields are for deleting the rest of the line
+	after an out-of-range level tag: rendering continues from
+	just past the next newline, skipping any tags before it.
+	Without a newline after it, the resume index is None.
+	Templates (and variable values, which are compiled the
+	same way) are cached, so each is only ever compiled once.
+	'''
+	profiler.count('templates compiled')
+	nodes = []
+	position = 0
+	for regex_tag in tag_expression.finditer(template):
+		start, end = regex_tag.span()
+		if start > position:
+			nodes.append(template[position:start])
+		nodes.append([regex_tag.group()[4:-4]])
+		position = end
+	if position < len(template):
+		nodes.append(template[position:])
+	profiler.count('tag matches', sum(isinstance(node, list) for node in nodes))
+
+	# Work backwards, tracking where each line resumes.
+	# Tags never span lines, so newlines are always literal.
+	resume_index, resume_text = None, ''
+	for index in reversed(range(len(nodes))):
+		node = nodes[index]
+		if isinstance(node, list):
+			[tag] = node
+			nodes[index] = (tag, resume_index, resume_text)
+		elif '\n' in node:
+			resume_index = index + 1
+			resume_text = node[node.index('\n') + 1:]
+	return tuple(nodes)
 
 
 
-# Helper function.
-def get_tag(markdown):
-	expression = r'`\{\( .+? \)\}`'
-	return re.search(expression, markdown)
+def delete_line(pieces):
+	'''
+	This deletes the current line from the text rendered so
+	far (given as pieces), back to the newline starting it.
+	If the text ends in a newline, that one does not count,
+	so the whole line before it is deleted as well.
+	'''
+	trailing = True
+	while pieces:
+		piece = pieces.pop()
+		limit = len(piece)
+		if trailing and piece:
+			trailing = False
+			if piece.endswith('\n'):
+				limit -= 1
+		cut = piece.rfind('\n', 0, limit)
+		if cut != -1:
+			pieces.append(piece[:cut])
+			return